@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+'''
+Description: Keeps an in-memory index of the matches in the feeds loaded by loadDataFeeds.py (those marked 'index' in
+             config.Settings.dataFeeds) and serves lookups as JSON over HTTP on localhost.
+
+The index is rebuilt for a feed whenever loadDataFeeds.py renames a new copy of it into place. Lookups:
+   GET /match/<match_id>            the match from every indexed feed it appears in
+   GET /team/<team name>            all matches for a team (case insensitive)
+   GET /competition/<competition>   all matches in a competition (case insensitive), e.g. /competition/England: Premier League
+
+'''
+
+import argparse
+import http.server
+import json
+import logging
+import os
+import sys
+import inspect
+import socketserver
+import threading
+import time
+import traceback
+import urllib.parse
+
+# Add the parent directory to sys.path so we can import local modules
+currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+parentdir = os.path.dirname(currentdir)
+sys.path.insert(0,parentdir)
+
+# Import local modules
+import config.Settings
+import util.FeedParser as FeedParser
+import util.IPUtils as IPUtils
+
+# Get script name
+scriptName = str(os.path.basename(__file__)).replace(".py", "")
+
+# Parse command line arguments
+parser = argparse.ArgumentParser()
+parser.add_argument("-p", "--port", type=int, default=config.Settings.FEED_INDEX_PORT, help="Port to serve lookups on (localhost only)")
+parser.add_argument("-d", "--debug", help="Debug mode", action="store_true")
+args = parser.parse_args()
+
+# Get logger
+loggingLevel = (logging.DEBUG if args.debug else logging.INFO)
+logger = IPUtils.getLogger(scriptName, loggingLevel)
+
+
+############################### GLOBAL VARIABLES ###############################
+
+# fileName -> (feedName, mtime of the copy indexed, matches in that copy)
+indexedFeeds = {}
+
+# The current index. It is replaced as a whole when a feed changes, so lookups always see a consistent index
+#   matches: match_id -> {feedName -> match}
+#   teams: lower case team name -> set of match_ids
+#   competitions: lower case competition name -> set of match_ids
+index = {'matches' : {}, 'teams' : {}, 'competitions' : {}}
+
+
+################################## FUNCTIONS ###################################
+
+#
+# getFeedName: Returns the name a feed's matches are given in lookup results, e.g. soccer/all/inplay_odds.xml
+#
+def getFeedName(feed):
+    return feed['category']+'/'+feed['competition']+'/'+feed['fileName']
+
+
+#
+# refreshFeeds: Re-parses any indexed feed that has a new copy on disk. Returns True if any feed changed
+#
+def refreshFeeds():
+    changed = False
+
+    for feed in config.Settings.dataFeeds:
+        if (not feed.get('index')):
+            continue
+
+        fileName = IPUtils.getDataFeedFileName(feed)
+        try:
+            mtime = os.stat(fileName).st_mtime_ns
+        except FileNotFoundError:
+            continue
+
+        if (fileName in indexedFeeds and indexedFeeds[fileName][1] == mtime):
+            continue
+
+        try:
+            indexedFeeds[fileName] = (getFeedName(feed), mtime, FeedParser.parseMatches(fileName))
+            changed = True
+            logger.info("Indexed "+str(len(indexedFeeds[fileName][2]))+" matches from "+fileName)
+        except Exception:
+            logger.error("Unable to index "+fileName+": "+traceback.format_exc())
+
+    return changed
+
+
+#
+# buildIndex: Builds a new index from the matches in every indexed feed
+#
+def buildIndex():
+    matches = {}
+    teams = {}
+    competitions = {}
+
+    for (feedName, mtime, feedMatches) in indexedFeeds.values():
+        for matchId, match in feedMatches.items():
+            matches.setdefault(matchId, {})[feedName] = match
+
+            for team in (match['home'], match['away']):
+                if (team != None):
+                    teams.setdefault(team.lower(), set()).add(matchId)
+
+            if (match['competition'] != None):
+                competitions.setdefault(match['competition'].lower(), set()).add(matchId)
+
+    return {'matches' : matches, 'teams' : teams, 'competitions' : competitions}
+
+
+#
+# refreshIndex: Keeps the index up to date with the feeds on disk. Runs in a background thread
+#
+def refreshIndex():
+    global index
+
+    while True:
+        try:
+            if (refreshFeeds()):
+                index = buildIndex()
+                logger.info("Index rebuilt: "+str(len(index['matches']))+" matches, "+str(len(index['teams']))+" teams, "+
+                            str(len(index['competitions']))+" competitions")
+        except Exception:
+            logger.error("Caught Exception: "+traceback.format_exc()+"\n"+str(sys.exc_info()[0]))
+
+        time.sleep(config.Settings.FEED_INDEX_REFRESH_INTERVAL)
+
+
+#
+# lookup: Returns the result of a lookup path (e.g. /match/123), or None if nothing was found
+#
+def lookup(path):
+    currentIndex = index
+    parts = urllib.parse.unquote(path).strip('/').split('/', 1)
+    if (len(parts) != 2):
+        return None
+
+    (lookupType, key) = parts
+    if (lookupType == 'match'):
+        return currentIndex['matches'].get(key)
+    elif (lookupType == 'team'):
+        matchIds = currentIndex['teams'].get(key.lower())
+    elif (lookupType == 'competition'):
+        matchIds = currentIndex['competitions'].get(key.lower())
+    else:
+        return None
+
+    if (matchIds == None):
+        return None
+    return {matchId : currentIndex['matches'][matchId] for matchId in matchIds}
+
+
+# Handles lookup requests
+class LookupRequestHandler(http.server.BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        result = lookup(urllib.parse.urlsplit(self.path).path)
+        body = json.dumps(result).encode('utf-8')
+
+        self.send_response(200 if result != None else 404)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+    # Log requests at debug level rather than to stderr
+    def log_message(self, format, *args):
+        logger.debug("Lookup "+(format % args))
+
+
+# Serves each lookup on its own thread
+class LookupServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    daemon_threads = True
+
+
+##################################### MAIN #####################################
+
+logger.info("STARTING")
+
+# Build the initial index before serving lookups
+refreshFeeds()
+index = buildIndex()
+
+refreshThread = threading.Thread(target=refreshIndex, daemon=True)
+refreshThread.start()
+
+server = LookupServer(('127.0.0.1', args.port), LookupRequestHandler)
+logger.info("Serving lookups on http://127.0.0.1:"+str(args.port))
+
+try:
+    server.serve_forever()
+except (KeyboardInterrupt, SystemExit):
+    logger.info("Received KeyboardInterrupt/SystemExit")
+finally:
+    server.server_close()
+    logger.info("STOPPING")
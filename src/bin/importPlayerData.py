@@ -7,22 +7,32 @@ Description: Used to import player data such as images.  Only processes players
 
 Steps:
 1. Download the player data from http://www.goalserve.com/xml/players.zip
-2. Unzip the player data into a folder (e.g. /var/tmp/inplayrs/files)
-3. Process each file in turn (attackers.xml, defenders.xml, midfielders.xml, goalkeepers.xml)
+2. Process the archive. Each of attackers.xml, defenders.xml, midfielders.xml and goalkeepers.xml is read straight from it
+   without unzipping to disk
+   e.g: importPlayerData.py 1 local /var/tmp/inplayrs/files/players.zip
+   Unzipped files can also be given, one or more at a time
    e.g: importPlayerData.py 1 local /var/tmp/inplayrs/files/players/midfielders.xml
 
+Most players in the files have no mapping. With -t, players are looked up as soon as their start tag is read, and unmapped
+players (including their images) are skipped over without being built
+   e.g: importPlayerData.py 1 local /var/tmp/inplayrs/files/players.zip -t
+
+Unzipped files can be parsed on several processes with -p (e.g. -p 4)
+   e.g: importPlayerData.py 1 local /var/tmp/inplayrs/files/players/*.xml -p 4
+
 Images will be stored to file, unless the -s3 option is specified, in which case the images will be stored to Amazon S3
 
 '''
 
 import argparse
+from base64 import decodebytes
 import logging
 import os
 import sys
 import inspect
+import zipfile
 import pymysql            # MySQL DB connection
 from lxml import etree    # xml parsing
-from boto.s3.connection import S3Connection
 
 # Add the parent directory to sys.path so we can import local modules
 currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
@@ -31,8 +41,17 @@ sys.path.insert(0,parentdir)
 
 # Import local modules
 import config.Connections
+import config.Settings
+import dao.DataSourceMappingDao as DataSourceMappingDao
 import metadata.XPath
+import util.ElementFilter as ElementFilter
 import util.IPUtils as IPUtils
+import util.ImageManifest as ImageManifest
+import util.ImagePipeline as ImagePipeline
+import util.MappingCache as MappingCache
+import util.MappingSnapshot as MappingSnapshot
+import util.ShardedParser as ShardedParser
+import util.XmlOffsetIndex as XmlOffsetIndex
 
 # Get script name
 scriptName = str(os.path.basename(__file__)).replace(".py", "")
@@ -41,11 +60,22 @@ scriptName = str(os.path.basename(__file__)).replace(".py", "")
 parser = argparse.ArgumentParser()
 parser.add_argument("data_source_id", type=int, help="ID of data_source from which we are importing team data")
 parser.add_argument("env", choices=['local', 'dev', 'prod'], metavar="env", help="Environment (local/dev/prod)")
-parser.add_argument("input_file", help="File containing team data")
+parser.add_argument("input_file", nargs='+', help="File(s) containing player data (e.g. midfielders.xml, or the players.zip archive)")
 parser.add_argument("-s3", "--storeToS3", help="Store images to Amazon S3, even if environment is not prod", action="store_true")
+parser.add_argument("-m", "--rebuildMappings", help="Rebuild the local snapshot of data_source_mappings from scratch (needed after mappings are changed or deleted in the DB)", action="store_true")
+parser.add_argument("-f", "--forceImages", help="Save every image, even if it has not changed since the last import", action="store_true")
+parser.add_argument("-r", "--reconcileS3", help="Check the image manifest against what is in Amazon S3 before importing (with -s3)", action="store_true")
+parser.add_argument("-w", "--imageWorkers", type=int, default=config.Settings.IMAGE_WORKERS, help="Number of threads used to decode and save images")
+parser.add_argument("-t", "--streaming", help="Streaming mode: find each player's id on its start tag with a scan of the raw bytes, and only parse the players we have a mapping for. input_file(s) must be unzipped XML", action="store_true")
+parser.add_argument("-p", "--processes", type=int, default=0, help="Parse players (and decode their images) on this many processes. input_file(s) must be unzipped XML")
 parser.add_argument("-d", "--debug", help="Debug mode", action="store_true")
 args = parser.parse_args()
 
+if (args.processes > 0 and args.streaming):
+    parser.error("-p cannot be used with -t")
+if ((args.processes > 0 or args.streaming) and any(zipfile.is_zipfile(inputFile) for inputFile in args.input_file)):
+    parser.error("-p and -t cannot be used with a zip archive input_file")
+
 # Get logger and set level
 loggingLevel = (logging.DEBUG if args.debug else logging.INFO)
 logger = IPUtils.getLogger(scriptName, loggingLevel)
@@ -55,72 +85,152 @@ dbConfig = config.Connections.dbConfig.get(args.env)
 db = pymysql.connect(host=dbConfig['host'], port=dbConfig['port'], user=dbConfig['user'], passwd=dbConfig['pass'], db=dbConfig['db'])
 db.autocommit(1)
 
-# Create Amazon S3 connection (used for storing images)
-s3conn = S3Connection(config.Connections.AWS_ACCESS_KEY_ID, config.Connections.AWS_SECRET_ACCESS_KEY)
-s3bucket = s3conn.get_bucket('storage.inplayrs.com', validate=False) # No need to validate as we know this bucket exists
+# Load manifest of images saved by previous imports, so unchanged images are not saved again
+imageManifest = None
+if (not args.forceImages):
+    imageManifest = ImageManifest.ImageManifest(IPUtils.getUserPath(config.Settings.IMAGE_MANIFEST_FILE))
+    if (args.reconcileS3 and args.storeToS3):
+        imageManifest.reconcileWithS3('images/players/')
+
+# Create pool of workers to save images (to Amazon S3 or file) while we parse
+imagePipeline = ImagePipeline.ImagePipeline(args.imageWorkers, config.Settings.IMAGE_QUEUE_SIZE, args.storeToS3, imageManifest)
 
 ############################### GLOBAL VARIABLES ############################### 
 
-# external_id -> internal_id
-playerDataSourceMappings = {}
+# external_id -> (internal_id, mapping_id), looked up in the local snapshot of data_source_mappings for each window of 
+# players parsed and cached up to MAPPING_CACHE_SIZE
+mappingDao = DataSourceMappingDao.DataSourceMappingDao(db, args.data_source_id)
+mappingSnapshot = MappingSnapshot.MappingSnapshot(MappingSnapshot.getSnapshotFileName(args.data_source_id), args.rebuildMappings)
+playerDataSourceMappings = MappingCache.MappingCache(lambda externalIds: mappingSnapshot.getMappings('player', externalIds, config.Settings.MAPPING_LOOKUP_BATCH_SIZE), 
+                                                     config.Settings.MAPPING_CACHE_SIZE)
 
 
 ################################## FUNCTIONS ################################### 
 
-def processPlayer(player):
+#
+# prefetchMappings: Fetches the data_source_mappings for a window of player XML in a single lookup
+#
+def prefetchMappings(playerWindow):
+    playerDataSourceMappings.prefetch([player.attrib['id'] for player in playerWindow])
+
+
+#
+# isMappedPlayer: Returns True if we have an ID mapping for the player with this external id (used in streaming mode, 
+#                 where the mappings for each window of players are prefetched with prefetchPlayerIdMappings)
+#
+def isMappedPlayer(externalPlayerId):
+    return (playerDataSourceMappings.get(externalPlayerId) != None)
+
+
+#
+# prefetchPlayerIdMappings: Fetches the data_source_mappings for a window of external player ids in a single lookup
+#
+def prefetchPlayerIdMappings(externalPlayerIds):
+    playerDataSourceMappings.prefetch(externalPlayerIds)
+
+
+#
+# extractPlayer: Returns a record of the details we need from player XML, or None if we have no ID mapping for the player.
+#                Runs in the worker processes when parsing on several processes, in which case the player image is decoded
+#                too (decodeImage)
+#
+def extractPlayer(player, decodeImage=False):
     externalPlayerID = int(player.attrib['id'])
-    internalPlayerID = playerDataSourceMappings.get(externalPlayerID)
+    playerMapping = playerDataSourceMappings.get(externalPlayerID)
     
     # Only process players for which we have ID mappings after loading team data
-    if (internalPlayerID != None):
-        playerName = metadata.XPath.Player_Name(player)[0].text
-        logger.info("Processing player external_id="+str(externalPlayerID)+", internal_id="+str(internalPlayerID)+", name="+playerName)
-        
-        # Save player image
-        if (len(metadata.XPath.Player_Image(player)) > 0 ):
-            fileName = None
-            fileType = None
-            
-            if (args.storeToS3):
-                logger.info("Saving player image to Amazon S3")
-                fileName = 'images/players/'+str(internalPlayerID)+'.jpg'
-                fileType = IPUtils.saveBase64EncodedImageToAmazonS3(metadata.XPath.Player_Image(player)[0].text, fileName, s3bucket)
-            else:
-                logger.info("Saving player image to file")
-                fileName = '/var/tmp/inplayrs/files/images/players/'+str(internalPlayerID)+'.jpg'
-                fileType = IPUtils.saveBase64EncodedImageToFile(metadata.XPath.Player_Image(player)[0].text, fileName)
-                
-            if (fileType == None):
-                logger.warning("Invalid image found in tag, unable to save")
-            else:
-                logger.info("Successfully saved image. fileType="+fileType+", fileName="+fileName)
-        else:
-            logger.info("No player image found")
-                               
+    if (playerMapping == None):
+        return None
+    
+    image = None
+    if (len(metadata.XPath.Player_Image(player)) > 0 ):
+        image = metadata.XPath.Player_Image(player)[0].text
+        if (decodeImage):
+            image = decodebytes(str(image).encode('ascii'))
+    
+    return {'id' : externalPlayerID,
+            'internalId' : playerMapping[0],
+            'name' : metadata.XPath.Player_Name(player)[0].text,
+            'image' : image}
 
-##################################### MAIN ##################################### 
 
-# Log start of processing
-logger.info("Importing player data.  data_source_id="+str(args.data_source_id)+", env="+args.env+", input_file="+args.input_file)
+#
+# extractPlayerForShard: extractPlayer for the worker processes, decoding the player image
+#
+def extractPlayerForShard(player):
+    return extractPlayer(player, True)
+
 
+#
+# initShardWorker: Runs in each worker process when it starts. Opens the worker's own connection to the mapping snapshot,
+#                  as the SQLite connection of the main process must not be used after forking
+#
+def initShardWorker():
+    global mappingSnapshot
+    mappingSnapshot = MappingSnapshot.MappingSnapshot(MappingSnapshot.getSnapshotFileName(args.data_source_id))
 
-# Load existing data_source_mappings for team and player table
-cursor = db.cursor()
-getDataSourceMappingsSql = '''SELECT m.external_id, m.internal_id FROM data_source_mapping m
-WHERE m.data_source = %s AND m.table = 'player' '''
-cursor.execute(getDataSourceMappingsSql, args.data_source_id)
 
-for row in cursor.fetchall():
-    playerDataSourceMappings[row[0]] = row[1]
+def processPlayer(player):
+    playerRecord = extractPlayer(player)
+    if (playerRecord != None):
+        processPlayerRecord(playerRecord)
+
 
-cursor.close()
+#
+# processPlayerRecord: Process the record of a player we have an ID mapping for
+#
+def processPlayerRecord(playerRecord):
+    internalPlayerID = playerRecord['internalId']
+    logger.info("Processing player external_id="+str(playerRecord['id'])+", internal_id="+str(internalPlayerID)+", name="+playerRecord['name'])
+    
+    # Save player image
+    if (playerRecord['image'] != None):
+        if (args.storeToS3):
+            logger.info("Queueing player image to be saved to Amazon S3")
+            fileName = 'images/players/'+str(internalPlayerID)+'.jpg'
+        else:
+            logger.info("Queueing player image to be saved to file")
+            fileName = '/var/tmp/inplayrs/files/images/players/'+str(internalPlayerID)+'.jpg'
+            
+        imagePipeline.submit(playerRecord['image'], fileName)
+    else:
+        logger.info("No player image found")
+                               
+
+##################################### MAIN ##################################### 
+
+# Log start of processing
+logger.info("Importing player data.  data_source_id="+str(args.data_source_id)+", env="+args.env+", input_file="+", ".join(args.input_file))
+
+
+# Bring the local snapshot of data_source_mappings up to date
+mappingSnapshot.refresh(mappingDao)
+
+
+# Load each file (or each position file in the archive) and process each player
+for inputFile in args.input_file:
+    for (xmlFileName, xmlFile) in IPUtils.openXmlFiles(inputFile, config.Settings.PLAYER_DATA_FILES):
+        logger.info("Processing players in "+xmlFileName)
+        if (args.processes > 0):
+            (encoding, playerElements) = XmlOffsetIndex.scanElements(inputFile, 'player')
+            for playerRecords in ShardedParser.parseShards(inputFile, encoding, playerElements, extractPlayerForShard, args.processes, initShardWorker):
+                for playerRecord in playerRecords:
+                    processPlayerRecord(playerRecord)
+        elif (args.streaming):
+            summary = ElementFilter.filterElements(inputFile, 'player', config.Settings.PLAYER_ID_PATTERN, isMappedPlayer, processPlayer, 
+                                                   config.Settings.IMPORT_LOOKUP_WINDOW, prefetchPlayerIdMappings)
+            logger.info("Processed "+str(summary['wanted'])+" mapped players, skipped "+str(summary['skipped'])+" unmapped players in "+xmlFileName)
+        else:
+            context = etree.iterparse(xmlFile, events=('end',), tag='player')
+            IPUtils.fast_iter_window(context, processPlayer, config.Settings.IMPORT_LOOKUP_WINDOW, prefetchMappings)
 
+logger.info("Mapping lookups served from cache: players="+str(playerDataSourceMappings.hits)+"/"+str(playerDataSourceMappings.lookups))
 
-# Load file and process each team
-context = etree.iterparse(args.input_file, events=('end',), tag='player')
-IPUtils.fast_iter(context, processPlayer)
 
+# Wait for the remaining images to be saved
+imageSummary = imagePipeline.close()
+logger.info("Images saved="+str(imageSummary['saved'])+", unchanged="+str(imageSummary['unchanged'])+", invalid="+str(imageSummary['invalid'])+", failed="+str(imageSummary['failed']))
 
-# Close DB & Amazon S3 Connections
+# Close DB Connection and mapping snapshot
+mappingSnapshot.close()
 db.close()
-s3conn.close()
@@ -7,20 +7,32 @@ Description: Loads team data from a file and populates into DB
 
 Steps:
 1. Load team data from http://www.goalserve.com/xml/teams.zip
-2. Unzip to a file (e.g. /var/tmp/inplayrs/files/teams.xml
-3. Process the file
-   e.g. importTeamData.py  1 1204 1 local /var/tmp/inplayrs/files/teams.xml
+2. Process the file. The zip archive can be given directly (it is read without unzipping to disk), or an unzipped teams.xml
+   e.g. importTeamData.py  1 1204 1 local /var/tmp/inplayrs/files/teams.zip
+
+To re-import competitions quickly, use -i to index teams.xml (unzipped) by league on the first run. Later runs against the
+same file seek straight to the teams in the requested competitions rather than parsing every team
+   e.g. importTeamData.py  1 1204 1 local /var/tmp/inplayrs/files/teams.xml -i
+
+Several competitions can be imported in a single pass of the file by giving each external:internal competition pair
+with -c instead of external_comp_id and internal_comp_id
+   e.g. importTeamData.py  1 local /var/tmp/inplayrs/files/teams.xml -c 1204:1 -c 1005:2
+
+Teams can be parsed on several processes with -p (e.g. -p 4), which can be combined with -i. input_file must be unzipped XML
+   e.g. importTeamData.py  1 1204 1 local /var/tmp/inplayrs/files/teams.xml -p 4
 
 Images will be stored to file, unless the -s3 option is specified, in which case the images will be stored to Amazon S3
 '''
 import argparse
+from base64 import decodebytes
 import logging
 import os
 import sys
 import inspect
+import traceback
+import zipfile
 import pymysql            # MySQL DB connection
 from lxml import etree    # xml parsing
-from boto.s3.connection import S3Connection
 
 # Get script name
 scriptName = str(os.path.basename(__file__)).replace(".py", "")
@@ -32,20 +44,51 @@ sys.path.insert(0,parentdir)
 
 # Import local modules
 import config.Connections
+import config.Settings
+import dao.DataSourceMappingDao as DataSourceMappingDao
 import metadata.XPath
 import util.IPUtils as IPUtils
+import util.ImageManifest as ImageManifest
+import util.ImagePipeline as ImagePipeline
+import util.MappingCache as MappingCache
+import util.MappingSnapshot as MappingSnapshot
+import util.ShardedParser as ShardedParser
+import util.XmlOffsetIndex as XmlOffsetIndex
 
 # Parse command line arguments
 parser = argparse.ArgumentParser()
 parser.add_argument("data_source_id", type=int, help="ID of data_source from which we are importing team data")
-parser.add_argument("external_comp_id", type=int, help="ID of external competition to load team data for")
-parser.add_argument("internal_comp_id", type=int, help="ID of internal competition to load team data for")
+parser.add_argument("external_comp_id", type=int, nargs='?', help="ID of external competition to load team data for")
+parser.add_argument("internal_comp_id", type=int, nargs='?', help="ID of internal competition to load team data for")
 parser.add_argument("env", choices=['local', 'dev', 'prod'], metavar="env", help="Environment (local/dev/prod)")
-parser.add_argument("input_file", help="File containing team data")
+parser.add_argument("input_file", help="File containing team data (teams.xml, or the teams.zip archive)")
+parser.add_argument("-c", "--competition", action="append", default=[], metavar="EXTERNAL:INTERNAL", help="External and internal competition ID pair to load team data for (can be repeated)")
 parser.add_argument("-d", "--debug", help="Debug mode", action="store_true")
+parser.add_argument("-i", "--useIndex", help="Use (building it if needed) an index of the teams in each league to parse only the teams needed. input_file must be unzipped XML", action="store_true")
 parser.add_argument("-s3", "--storeToS3", help="Store images to Amazon S3, even if environment is not prod", action="store_true")
+parser.add_argument("-m", "--rebuildMappings", help="Rebuild the local snapshot of data_source_mappings from scratch (needed after mappings are changed or deleted in the DB)", action="store_true")
+parser.add_argument("-f", "--forceImages", help="Save every image, even if it has not changed since the last import", action="store_true")
+parser.add_argument("-r", "--reconcileS3", help="Check the image manifest against what is in Amazon S3 before importing (with -s3)", action="store_true")
+parser.add_argument("-w", "--imageWorkers", type=int, default=config.Settings.IMAGE_WORKERS, help="Number of threads used to decode and save images")
+parser.add_argument("-p", "--processes", type=int, default=0, help="Parse teams (and decode their images) on this many processes. input_file must be unzipped XML")
+parser.add_argument("-b", "--batchSize", type=int, default=config.Settings.IMPORT_BATCH_SIZE, help="Number of new players/mappings to write per multi-row insert (1 = write each one straight away)")
 args = parser.parse_args()
 
+# external_comp_id -> [internal_comp_ids] for every competition we are loading
+competitions = {}
+if (args.external_comp_id != None and args.internal_comp_id != None):
+    competitions[str(args.external_comp_id)] = [args.internal_comp_id]
+for competition in args.competition:
+    try:
+        (externalCompId, internalCompId) = competition.split(':')
+        competitions.setdefault(str(int(externalCompId)), []).append(int(internalCompId))
+    except ValueError:
+        parser.error("Invalid competition "+competition+", expected EXTERNAL:INTERNAL, e.g. 1204:1")
+if (len(competitions) == 0):
+    parser.error("Either external_comp_id and internal_comp_id, or at least one -c EXTERNAL:INTERNAL, must be given")
+if ((args.useIndex or args.processes > 0) and zipfile.is_zipfile(args.input_file)):
+    parser.error("-i and -p can only be used with an unzipped XML input_file")
+
 # Get logger
 loggingLevel = (logging.DEBUG if args.debug else logging.INFO)
 logger = IPUtils.getLogger(scriptName, loggingLevel)
@@ -55,141 +98,229 @@ dbConfig = config.Connections.dbConfig.get(args.env)
 db = pymysql.connect(host=dbConfig['host'], port=dbConfig['port'], user=dbConfig['user'], passwd=dbConfig['pass'], db=dbConfig['db'])
 db.autocommit(1)
 
-# Create Amazon S3 connection (used for storing images)
-s3conn = S3Connection(config.Amazon.AWS_ACCESS_KEY_ID, config.Amazon.AWS_SECRET_ACCESS_KEY)
-s3bucket = s3conn.get_bucket('storage.inplayrs.com', validate=False) # No need to validate as we know this bucket exists
+# Load manifest of images saved by previous imports, so unchanged images are not saved again
+imageManifest = None
+if (not args.forceImages):
+    imageManifest = ImageManifest.ImageManifest(IPUtils.getUserPath(config.Settings.IMAGE_MANIFEST_FILE))
+    if (args.reconcileS3 and args.storeToS3):
+        imageManifest.reconcileWithS3('images/teams/')
+
+# Create pool of workers to save images (to Amazon S3 or file) while we parse
+imagePipeline = ImagePipeline.ImagePipeline(args.imageWorkers, config.Settings.IMAGE_QUEUE_SIZE, args.storeToS3, imageManifest)
 
 ############################### GLOBAL VARIABLES ############################### 
 
-# name -> team_id
+# internal_comp_id -> {name -> team_id}
 teams = {}
 
-# internalTeamId:name -> player_id
+# team_id -> {name -> player_id}, loaded for each team when it is first processed
 players = {}
 
-# external_id -> {internal_id, mapping_id}
-teamDataSourceMappings = {}
-playerDataSourceMappings = {}
+# external_id -> (internal_id, mapping_id), looked up in the local snapshot of data_source_mappings as the ids are seen and 
+# cached up to MAPPING_CACHE_SIZE per table
+mappingDao = DataSourceMappingDao.DataSourceMappingDao(db, args.data_source_id)
+mappingSnapshot = MappingSnapshot.MappingSnapshot(MappingSnapshot.getSnapshotFileName(args.data_source_id), args.rebuildMappings)
+teamDataSourceMappings = MappingCache.MappingCache(lambda externalIds: mappingSnapshot.getMappings('team', externalIds, config.Settings.MAPPING_LOOKUP_BATCH_SIZE), 
+                                                   config.Settings.MAPPING_CACHE_SIZE)
+playerDataSourceMappings = MappingCache.MappingCache(lambda externalIds: mappingSnapshot.getMappings('player', externalIds, config.Settings.MAPPING_LOOKUP_BATCH_SIZE), 
+                                                     config.Settings.MAPPING_CACHE_SIZE)
+
+# New players [(name, team_id, external_id)] and data_source_mappings [(table, internal_id, external_id)] waiting to be 
+# written in the next batch
+pendingPlayers = []
+pendingDataSourceMappings = []
+
+# table -> {external_id (int) -> internal_id} of the data_source_mappings waiting to be written (internal_id is None for 
+# players that have not been inserted yet), so the same external id is not mapped twice before the batch is written
+pendingMappings = {'team' : {}, 'player' : {}}
 
 
 ################################## FUNCTIONS ################################### 
     
 #
-# Process team XML
+# getInternalCompIds: Returns the internal_comp_ids of the competitions we are loading that a team is in
 #
-def processTeam(team):
-    teamIsInCompetiton = False
-    
-    # Only process the team if they are in the competition (external_comp_id)
+def getInternalCompIds(team):
+    internalCompIds = []
     for league_id in metadata.XPath.Team_LeagueIDs(team):
-        if (league_id.text == str(args.external_comp_id)):
-            teamIsInCompetiton = True
+        internalCompIds.extend(competitions.get(league_id.text, []))
+    return internalCompIds
+
+
+#
+# prefetchMappings: Fetches the data_source_mappings for the teams in a window of team XML that we are loading, and 
+#                   their players, so they are looked up in a few queries rather than one per team/player
+#
+def prefetchMappings(teamWindow):
+    teamWindow = [team for team in teamWindow if len(getInternalCompIds(team)) > 0]
+    teamDataSourceMappings.prefetch([team.attrib['id'] for team in teamWindow])
+    playerDataSourceMappings.prefetch([player.attrib['id'] for team in teamWindow for player in metadata.XPath.Team_Players(team)])
+
+
+#
+# prefetchRecordMappings: Fetches the data_source_mappings for a list of team records and their players
+#
+def prefetchRecordMappings(teamRecords):
+    teamDataSourceMappings.prefetch([teamRecord['id'] for teamRecord in teamRecords])
+    playerDataSourceMappings.prefetch([externalPlayerId for teamRecord in teamRecords for (externalPlayerId, playerName) in teamRecord['players']])
+
+
+#
+# getMapping: Returns (internal_id, mapping_id) of the data_source_mapping for an external id of a table, or None if it has
+#             none. Mappings waiting to be written in the next batch are included, with a mapping_id of None
+#
+def getMapping(table, externalId):
+    if (int(externalId) in pendingMappings[table]):
+        return (pendingMappings[table][int(externalId)], None)
     
-    if (not teamIsInCompetiton):
-        return
+    mappings = (teamDataSourceMappings if table == 'team' else playerDataSourceMappings)
+    return mappings.get(externalId)
+
+
+#
+# extractTeam: Returns a record of the details we need from team XML, or None if the team is not in any of the competitions
+#              we are loading. Runs in the worker processes when parsing on several processes, in which case the team image
+#              is decoded too (decodeImage)
+#
+def extractTeam(team, decodeImage=False):
+    # Only process the team if they are in one of the competitions we are loading (external_comp_id)
+    internalCompIds = getInternalCompIds(team)
+    if (len(internalCompIds) == 0):
+        return None
     
-    teamName = metadata.XPath.Team_Name(team)[0].text
-    externalTeamID = team.attrib['id']
+    image = None
+    if (len(metadata.XPath.Team_Image(team)) > 0 ):
+        image = metadata.XPath.Team_Image(team)[0].text
+        if (decodeImage):
+            image = decodebytes(str(image).encode('ascii'))
     
-    logger.info("Processing team: "+teamName+", external_id: "+externalTeamID)
+    return {'id' : team.attrib['id'],
+            'name' : metadata.XPath.Team_Name(team)[0].text,
+            'internalCompIds' : sorted(set(internalCompIds)),
+            'image' : image,
+            'players' : [(player.attrib['id'], player.attrib['name']) for player in metadata.XPath.Team_Players(team)]}
+
+
+#
+# extractTeamForShard: extractTeam for the worker processes, decoding the team image
+#
+def extractTeamForShard(team):
+    return extractTeam(team, True)
+
+
+#
+# Process team XML
+#
+def processTeam(team):
+    teamRecord = extractTeam(team)
+    if (teamRecord != None):
+        processTeamRecord(teamRecord)
+
+
+#
+# processTeamRecord: Process the record of a team in each of our competitions they are in
+#
+def processTeamRecord(teamRecord):
+    for internalCompId in teamRecord['internalCompIds']:
+        processTeamForCompetition(teamRecord, internalCompId)
+
+
+#
+# Process team for one of our competitions
+#
+def processTeamForCompetition(teamRecord, internalCompId):
+    teamName = teamRecord['name']
+    externalTeamID = teamRecord['id']
+    compTeams = teams.setdefault(internalCompId, {})
+    logger.info("Processing team: "+teamName+", external_id: "+externalTeamID+", competition: "+str(internalCompId))
 
     # Check if a team with that name exists for that competition (internal_comp_id) in team table, and if not, insert it and keep the ID
-    if (teams.get(teamName) == None):
+    if (compTeams.get(teamName) == None):
         
         # Check if there is an existing mapping first, and if so, throw an error and stop processing this team
-        if(teamDataSourceMappings.get(externalTeamID) != None):
+        teamMapping = getMapping('team', externalTeamID)
+        if(teamMapping != None):
             logger.error("Team with name "+teamName+" does not exist however there is already a data_source_mapping for this team: mapping_id="+
-                         teamDataSourceMappings[externalTeamID]['mapping_id']+", skipping processing of this team. Please update team name in DB if name has changed.")
+                         str(teamMapping[1] or "(pending insert)")+", skipping processing of this team. Please update team name in DB if name has changed.")
             return
         
         # Insert new team
-        logger.info("Inserting new team. name="+teamName+", competition="+str(args.internal_comp_id))
-        newTeamId = insertTeam(teamName, args.internal_comp_id)
+        logger.info("Inserting new team. name="+teamName+", competition="+str(internalCompId))
+        newTeamId = insertTeam(teamName, internalCompId)
         if (newTeamId > 0):
             logger.info("New team_id for "+teamName+": "+str(newTeamId))
-            teams[teamName] = newTeamId
+            compTeams[teamName] = newTeamId
             
-            # Create new data source mapping for the team
-            logger.info("Creating new data_source_mapping entry for team: internal_id="+newTeamId+", external_id="+externalTeamID)
-            newDataSourceMappingID = insertDataSourceMapping(args.data_source_id, 'team', newTeamId, int(externalTeamID))
-            if (newDataSourceMappingID > 0):
-                teamDataSourceMappings[externalTeamID] = {"internal_id" : newTeamId, "mapping_id:" : newDataSourceMappingID}
-            else:
-                logger.error("Failed to create new data_source_mapping for team with internal_id="+newTeamId+", external_id="+externalTeamID+". skipping processing of this team")
-                return
+            # Queue new data source mapping for the team
+            logger.info("Creating new data_source_mapping entry for team: internal_id="+str(newTeamId)+", external_id="+externalTeamID)
+            queueDataSourceMapping('team', newTeamId, externalTeamID)
             
         else:
             logger.error("Failed to insert team "+teamName+", skipping processing of this team")
             return
     else:
-        logger.info("Team already exists in DB with team_id "+str(teams.get(teamName)))
+        logger.info("Team already exists in DB with team_id "+str(compTeams.get(teamName)))
 
     # Save team image
-    if (len(metadata.XPath.Team_Image(team)) > 0 ):
-        fileName = None
-        fileType = None
-        
+    if (teamRecord['image'] != None):
         if (args.storeToS3):
-            logger.info("Saving team image to Amazon S3")
-            fileName = 'images/teams/'+str(teams[teamName])+'.jpg'
-            fileType = IPUtils.saveBase64EncodedImageToAmazonS3(metadata.XPath.Team_Image(team)[0].text, fileName, s3bucket)
+            logger.info("Queueing team image to be saved to Amazon S3")
+            fileName = 'images/teams/'+str(compTeams[teamName])+'.jpg'
         else:
-            logger.info("Saving team image to file")
-            fileName = '/var/tmp/inplayrs/files/images/teams/'+str(teams[teamName])+'.jpg'
-            fileType = IPUtils.saveBase64EncodedImageToFile(metadata.XPath.Team_Image(team)[0].text, fileName)
+            logger.info("Queueing team image to be saved to file")
+            fileName = '/var/tmp/inplayrs/files/images/teams/'+str(compTeams[teamName])+'.jpg'
             
-        if (fileType == None):
-            logger.warning("Invalid image found in tag, unable to save")
-        else:
-            logger.info("Successfully saved image fileType="+fileType+", fileName="+fileName)
+        imagePipeline.submit(teamRecord['image'], fileName)
     else:
         logger.info("No team image found")
             
     # Cycle through the squad and inert into the player table if they do not already exist
-    for player in metadata.XPath.Team_Players(team):
-        processPlayer(player, teams[teamName])
+    loadTeamPlayers(compTeams[teamName])
+    for (externalPlayerId, playerName) in teamRecord['players']:
+        processPlayer(externalPlayerId, playerName, compTeams[teamName])
 
 
 #
-# Process player XML
+# loadTeamPlayers: Loads the existing players of a team from the DB, unless they have already been loaded
 #
-def processPlayer(player, internalTeamId):
-    playerName = player.attrib['name']
-    externalPlayerId = player.attrib['id']
-    teamAndExternalPlayerId = str(internalTeamId)+':'+playerName
+def loadTeamPlayers(teamId):
+    if (teamId in players):
+        return
+    
+    cursor = db.cursor()
+    getExistingPlayersForTeamSql = "SELECT player_id, name FROM player WHERE team = %s"
+    cursor.execute(getExistingPlayersForTeamSql, teamId)
+    players[teamId] = {row[1] : row[0] for row in cursor.fetchall()}
+    cursor.close()
+
+
+#
+# Process player in a team's squad
+#
+def processPlayer(externalPlayerId, playerName, internalTeamId):
+    teamPlayers = players[internalTeamId]
     logger.info("Processing player: "+playerName+", external_id="+externalPlayerId)
     
     # Check if player already exists in the player table, and if not, insert them
-    if (players.get(teamAndExternalPlayerId) == None):
+    if (playerName not in teamPlayers):
         
         # Check if there is an existing mapping first, and if so, throw an error and stop processing this player
-        if(playerDataSourceMappings.get(externalPlayerId) != None):
+        playerMapping = getMapping('player', externalPlayerId)
+        if(playerMapping != None):
             logger.error("Player with name "+playerName+" does not exist however there is already a data_source_mapping for this player: mapping_id="+
-                         str(playerDataSourceMappings[externalPlayerId]['mapping_id'])+", skipping processing of this player. Please update player name in DB if name has changed.")
+                         str(playerMapping[1] or "(pending insert)")+", skipping processing of this player. Please update player name in DB if name has changed.")
             return
         
-        # Insert new player
+        # Queue new player, which will be inserted along with its data source mapping in the next batch
         logger.info("Inserting new player. name="+playerName+", team="+str(internalTeamId))
-        newPlayerId = insertPlayer(playerName, internalTeamId)
-        if (newPlayerId > 0):
-            logger.info("New player_id for "+playerName+": "+str(newPlayerId))
-            players[teamAndExternalPlayerId] = newPlayerId
-            
-            # Create new data source mapping for the player
-            logger.info("Creating new data_source_mapping entry for player: internal_id="+str(newPlayerId)+", external_id="+externalPlayerId)
-            newDataSourceMappingID = insertDataSourceMapping(args.data_source_id, 'player', newPlayerId, int(externalPlayerId))
-            if (newDataSourceMappingID > 0):
-                playerDataSourceMappings[externalPlayerId] = {"internal_id" : newPlayerId, "mapping_id:" : newDataSourceMappingID}
-            else:
-                logger.error("Failed to create new data_source_mapping for player with internal_id="+str(newPlayerId)+", external_id="+externalPlayerId+". skipping processing of this player")
-                return
-            
-        else:
-            logger.error("Failed to insert player "+playerName+", skipping processing of this player")
-            return
+        teamPlayers[playerName] = None
+        pendingPlayers.append((playerName, internalTeamId, externalPlayerId))
+        pendingMappings['player'][int(externalPlayerId)] = None
+        if (len(pendingPlayers) >= args.batchSize):
+            flushPendingWrites()
         
     else:
-        logger.info("Player already exists in DB with player_id "+str(players[teamAndExternalPlayerId]))
+        logger.info("Player already exists in DB with player_id "+str(teamPlayers[playerName] or "(pending insert)"))
       
       
 
@@ -207,85 +338,165 @@ def insertTeam(teamName, competition):
     return cursor.lastrowid
 
 
-# Insert player into DB
-def insertPlayer(playerName, teamId):
-    insertPlayerSQL = "INSERT INTO player(name, team) VALUES (%s, %s)"
-    cursor = db.cursor()
-    result = cursor.execute(insertPlayerSQL, (playerName, teamId))
+#
+# queueDataSourceMapping: Queues a new data source mapping to be written in the next batch
+#
+def queueDataSourceMapping(table, internal_id, external_id):
+    pendingDataSourceMappings.append((table, internal_id, external_id))
+    pendingMappings[table][int(external_id)] = internal_id
+    if (len(pendingDataSourceMappings) >= args.batchSize):
+        flushPendingWrites()
+
+
+#
+# flushPendingWrites: Writes all pending players and their data source mappings in a single transaction, using 
+#                     multi-row inserts. The ids of the new rows are then loaded so mappings can reference new players.
+#                     Teams have already been inserted, so if the batch fails their mappings are kept queued to be retried
+#
+def flushPendingWrites():
+    global pendingPlayers, pendingDataSourceMappings
     
-    if (result != 1):
-        cursor.close()
-        return -1
+    if (len(pendingPlayers) == 0 and len(pendingDataSourceMappings) == 0):
+        return
     
-    cursor.close()
-    return cursor.lastrowid
+    batchPlayers = pendingPlayers
+    batchDataSourceMappings = pendingDataSourceMappings
+    pendingPlayers = []
+    pendingDataSourceMappings = []
+    
+    logger.info("Writing batch of "+str(len(batchPlayers))+" new players and "+str(len(batchDataSourceMappings))+" new data_source_mappings")
+    db.begin()
+    try:
+        if (len(batchPlayers) > 0):
+            newPlayerIds = insertPlayers(batchPlayers)
+            for ((playerName, teamId, externalPlayerId), newPlayerId) in zip(batchPlayers, newPlayerIds):
+                logger.info("New player_id for "+playerName+": "+str(newPlayerId))
+                players[teamId][playerName] = newPlayerId
+                batchDataSourceMappings.append(('player', newPlayerId, externalPlayerId))
+        
+        newMappingIds = insertDataSourceMappings(args.data_source_id, batchDataSourceMappings)
+        db.commit()
+        
+    except Exception:
+        db.rollback()
+        
+        # Forget the players we were inserting so they are not treated as existing
+        for (playerName, teamId, externalPlayerId) in batchPlayers:
+            players[teamId].pop(playerName, None)
+            pendingMappings['player'].pop(int(externalPlayerId), None)
+        pendingDataSourceMappings = [mapping for mapping in batchDataSourceMappings if mapping[0] == 'team'] + pendingDataSourceMappings
+        logger.error("Failed to write batch of players/data_source_mappings, batch has been rolled back: "+traceback.format_exc())
+        return
+    
+    for ((table, internal_id, external_id), newMappingId) in zip(batchDataSourceMappings, newMappingIds):
+        pendingMappings[table].pop(int(external_id), None)
+        mappings = (teamDataSourceMappings if table == 'team' else playerDataSourceMappings)
+        mappings.put(external_id, internal_id, newMappingId)
+    
+    # Also add them to the snapshot, as the caches are bounded and may evict them before the end of the import
+    mappingSnapshot.addMappings([(table, external_id, internal_id, newMappingId) 
+                                 for ((table, internal_id, external_id), newMappingId) in zip(batchDataSourceMappings, newMappingIds)])
 
 
-# Insert new data source mapping
-def insertDataSourceMapping(data_source, table, internal_id, external_id):
-    insertDataSourceMappingSql = "INSERT INTO data_source_mapping(data_source, `table`, internal_id, external_id) VALUES (%s, %s, %s, %s)"
+# Insert rows with a single multi-row INSERT (insertSql followed by a placeholder per row), returning the auto-increment 
+# ids of the new rows in order. InnoDB allocates the ids of a multi-row insert consecutively (in steps of 
+# auto_increment_increment), so they follow on from the first id, which is the lastrowid
+def insertRows(insertSql, rowPlaceholder, rows):
+    if (len(rows) == 0):
+        return []
     
     cursor = db.cursor()
-    result = cursor.execute(insertDataSourceMappingSql, (data_source, table, internal_id, external_id))
-    
-    if (result != 1):
+    cursor.execute("SELECT @@auto_increment_increment")
+    (increment,) = cursor.fetchone()
+    cursor.execute(insertSql+" "+", ".join([rowPlaceholder] * len(rows)), [value for row in rows for value in row])
+    if (cursor.rowcount != len(rows)):
         cursor.close()
-        return -1
+        raise Exception("Inserted "+str(cursor.rowcount)+" rows, expected "+str(len(rows)))
     
+    firstId = cursor.lastrowid
     cursor.close()
-    return cursor.lastrowid
+    return [firstId + i * increment for i in range(len(rows))]
 
-##################################### MAIN ##################################### 
 
-# Log start of processing
-logger.info("Importing team data.  data_source_id="+str(args.data_source_id)+", external_comp_id="+str(args.external_comp_id)+
-             ", internal_comp_id="+str(args.internal_comp_id)+", env="+args.env+", input_file="+args.input_file)
-
-# Load existing team data for this competition
-cursor = db.cursor()
-getExistingTeamsForCompSql = "SELECT team_id, name FROM team WHERE competition = %s"
-cursor.execute(getExistingTeamsForCompSql, args.internal_comp_id)
+# Insert players into DB, returning the player_ids of the new players in order
+def insertPlayers(newPlayers):
+    return insertRows("INSERT INTO player(name, team) VALUES", "(%s, %s)", 
+                      [(playerName, teamId) for (playerName, teamId, externalPlayerId) in newPlayers])
 
-for row in cursor.fetchall():
-    teams[row[1]] = row[0]
-    
-cursor.close()
 
+# Insert new data source mappings, returning the mapping_ids of the new mappings in order
+def insertDataSourceMappings(data_source, newDataSourceMappings):
+    return insertRows("INSERT INTO data_source_mapping(data_source, `table`, internal_id, external_id) VALUES", "(%s, %s, %s, %s)", 
+                      [(data_source, table, internal_id, int(external_id)) for (table, internal_id, external_id) in newDataSourceMappings])
 
-# Load existing player data for this competition
-cursor = db.cursor()
-getExistingPlayersForCompSql = '''SELECT p.player_id, p.name, p.team 
-FROM player p LEFT JOIN team t on p.team = t.team_id 
-WHERE t.competition = %s'''
-cursor.execute(getExistingPlayersForCompSql, args.internal_comp_id)
+##################################### MAIN ##################################### 
 
-for row in cursor.fetchall():
-    players[str(row[2])+':'+row[1]] = row[0]
-    
-cursor.close()
+# Log start of processing
+logger.info("Importing team data.  data_source_id="+str(args.data_source_id)+", competitions (external:internal)="+
+            ", ".join([externalCompId+':'+str(internalCompId) for externalCompId, internalCompIds in competitions.items() for internalCompId in internalCompIds])+
+            ", env="+args.env+", input_file="+args.input_file)
 
+internalCompIds = sorted({internalCompId for internalCompIds in competitions.values() for internalCompId in internalCompIds})
+compIdsSql = ", ".join(["%s"] * len(internalCompIds))
 
-# Load existing data_source_mappings for team and player table
+# Load existing team data for these competitions
 cursor = db.cursor()
-getDataSourceMappingsSql = '''SELECT m.table, m.external_id, m.internal_id, m.mapping_id FROM data_source_mapping m
-WHERE m.data_source = %s AND m.table IN ('team', 'player')'''
-cursor.execute(getDataSourceMappingsSql, args.data_source_id)
+getExistingTeamsForCompSql = "SELECT team_id, name, competition FROM team WHERE competition IN ("+compIdsSql+")"
+cursor.execute(getExistingTeamsForCompSql, internalCompIds)
 
 for row in cursor.fetchall():
-    if (row[0] == 'team'):
-        teamDataSourceMappings[row[1]] = {"internal_id" : row[2], "mapping_id" : row[3]}
-    elif (row[0] == 'player'):
-        playerDataSourceMappings[row[1]] = {"internal_id" : row[2], "mapping_id" : row[3]}
-
+    teams.setdefault(row[2], {})[row[1]] = row[0]
+    
 cursor.close()
 
 
-# Load file and process each team
-context = etree.iterparse(args.input_file, events=('end',), tag='team')
-IPUtils.fast_iter(context, processTeam)
+# Bring the local snapshot of data_source_mappings up to date
+mappingSnapshot.refresh(mappingDao)
 
 
-# Close DB & Amazon S3 Connections
+# Load file and process each team
+if (args.processes > 0):
+    # Parse on several processes, either only the teams in our competitions (using the index) or every team
+    if (args.useIndex):
+        (teamIndex, indexBuilt) = XmlOffsetIndex.loadIndex(args.input_file, 'team', config.Settings.TEAM_INDEX_LEAGUE_PATTERN)
+        (encoding, teamElements) = (teamIndex['encoding'], XmlOffsetIndex.getElements(teamIndex, set(competitions)))
+    else:
+        (encoding, teamElements) = XmlOffsetIndex.scanElements(args.input_file, 'team')
+    logger.info("Parsing "+str(len(teamElements))+" teams in "+args.input_file+" on "+str(args.processes)+" processes")
+    
+    for teamRecords in ShardedParser.parseShards(args.input_file, encoding, teamElements, extractTeamForShard, args.processes):
+        prefetchRecordMappings(teamRecords)
+        for teamRecord in teamRecords:
+            processTeamRecord(teamRecord)
+elif (args.useIndex):
+    # Only parse the teams in our competitions, using the index of which teams are in each league
+    (teamIndex, indexBuilt) = XmlOffsetIndex.loadIndex(args.input_file, 'team', config.Settings.TEAM_INDEX_LEAGUE_PATTERN)
+    logger.info(("Built" if indexBuilt else "Loaded")+" index of "+str(len(teamIndex['elements']))+" teams in "+args.input_file)
+    
+    context = (('end', team) for team in XmlOffsetIndex.iterElements(args.input_file, teamIndex, set(competitions)))
+    IPUtils.fast_iter_window(context, processTeam, config.Settings.IMPORT_LOOKUP_WINDOW, prefetchMappings)
+else:
+    for (xmlFileName, xmlFile) in IPUtils.openXmlFiles(args.input_file):
+        logger.info("Processing teams in "+xmlFileName)
+        context = etree.iterparse(xmlFile, events=('end',), tag='team')
+        IPUtils.fast_iter_window(context, processTeam, config.Settings.IMPORT_LOOKUP_WINDOW, prefetchMappings)
+
+# Write any players and mappings left in the last batch, retrying once for team mappings kept from a failed batch
+flushPendingWrites()
+if (len(pendingDataSourceMappings) > 0):
+    flushPendingWrites()
+for (table, internal_id, external_id) in pendingDataSourceMappings:
+    logger.error("Unable to create data_source_mapping for "+table+": internal_id="+str(internal_id)+", external_id="+str(external_id)+
+                 ". Please insert this mapping by hand, as the "+table+" will be found by name on the next import")
+logger.info("Mapping lookups served from cache: teams="+str(teamDataSourceMappings.hits)+"/"+str(teamDataSourceMappings.lookups)+
+            ", players="+str(playerDataSourceMappings.hits)+"/"+str(playerDataSourceMappings.lookups))
+
+
+# Wait for the remaining images to be saved
+imageSummary = imagePipeline.close()
+logger.info("Images saved="+str(imageSummary['saved'])+", unchanged="+str(imageSummary['unchanged'])+", invalid="+str(imageSummary['invalid'])+", failed="+str(imageSummary['failed']))
+
+# Close DB Connection and mapping snapshot
+mappingSnapshot.close()
 db.close()
-s3conn.close()
 
@@ -4,16 +4,25 @@
 
 Description: Loads XML data feeds and stores to local disk
 
+Each feed is loaded on its own schedule (its 'interval' in config.Settings.dataFeeds, or dataFeedInterval for its type),
+so a single process can load both preplay and inplay feeds:
+   e.g. loadDataFeeds.py         (all feeds)
+        loadDataFeeds.py inplay  (inplay feeds only)
+
 '''
 
 import argparse
+import bisect
+import concurrent.futures
+import hashlib
+import heapq
 import logging
 import os
+import random
 import sys
 import inspect
 import time
 import traceback
-import urllib.request
 
 # Add the parent directory to sys.path so we can import local modules
 currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
@@ -23,20 +32,62 @@ sys.path.insert(0,parentdir)
 # Import local modules
 import config.Settings
 import util.IPUtils as IPUtils
+import util.ContentDecoder as ContentDecoder
+import util.FeedArchive as FeedArchive
+import util.FeedCache as FeedCache
+import util.FeedDiff as FeedDiff
+import util.FeedParser as FeedParser
+import util.HttpConnectionPool as HttpConnectionPool
 
 # Get script name
 scriptName = str(os.path.basename(__file__)).replace(".py", "")
 
 # Parse command line arguments
 parser = argparse.ArgumentParser()
-parser.add_argument("type", choices=['preplay', 'inplay'], metavar="type", help="Type (preplay/inplay)")
+parser.add_argument("type", nargs='?', default='all', choices=['preplay', 'inplay', 'all'], metavar="type", help="Type of feeds to load (preplay/inplay/all), defaults to all")
 parser.add_argument("-d", "--debug", help="Debug mode", action="store_true")
+parser.add_argument("-a", "--adaptive", help="Load adaptive feeds quickly while matches are live and slowly when they are not", action="store_true")
+parser.add_argument("-r", "--archive", help="Archive every new snapshot of each feed, compressed, so it can be replayed later", action="store_true")
+parser.add_argument("-w", "--workers", type=int, default=config.Settings.DATA_FEED_WORKERS, help="Number of feeds to download concurrently (1 = download one at a time)")
 args = parser.parse_args()
 
 # Get logger
 loggingLevel = (logging.DEBUG if args.debug else logging.INFO)
 logger = IPUtils.getLogger(scriptName, loggingLevel)
 
+# Pool of worker threads used to download feeds in parallel
+executor = concurrent.futures.ThreadPoolExecutor(max_workers=max(1, args.workers))
+
+# Keep-alive HTTP connections, shared by all feeds on the same host
+httpPool = HttpConnectionPool.HttpConnectionPool(config.Settings.DATA_FEED_POOL_SIZE,
+                                                 config.Settings.DATA_FEED_CONNECT_TIMEOUT,
+                                                 config.Settings.DATA_FEED_READ_TIMEOUT)
+
+
+############################### GLOBAL VARIABLES ############################### 
+
+# fileName -> {etag, lastModified, digest} of the copy of each feed currently stored on disk, and whether that copy has
+# still to be archived (unarchived) and have its change log and binary cache written (unprocessed), e.g. after a failure
+feedState = {}
+
+# Heap of (dueTime, feedIndex, slotTime) giving the next time each feed is due to be loaded. slotTime is the
+# feed's fixed cadence slot, and dueTime is the slot plus any jitter or the retry time after a failure
+schedule = []
+
+# future -> (feedIndex, slotTime, dueTime) for each feed currently being loaded by the worker pool
+loadsInProgress = {}
+
+# feedIndex -> number of consecutive failures loading that feed
+feedFailures = {}
+
+# (number of live matches, sorted kick-off times of upcoming matches) from the latest live match detection feed, 
+# and whether adaptive feeds are currently being loaded at the live interval
+matchActivity = None
+matchesLive = True
+
+# fileName -> matches in the latest snapshot of each feed that has a change log
+previousMatches = {}
+
 
 ################################## FUNCTIONS ################################### 
 
@@ -44,21 +95,263 @@ def loadDataFeed(feed):
     logger.info("Loading feed: "+IPUtils.dictToString(feed))
     
     filePath = IPUtils.getDataFeedFilePath(feed)
-    fileName = filePath +'/' +feed['fileName']
+    fileName = IPUtils.getDataFeedFileName(feed)
     tempFile = fileName+'.tmp'
     
-    # Create storage directory if it doesn't already exist
-    if not os.path.exists(filePath):
-        os.makedirs(filePath)
+    # Create storage directory if it doesn't already exist (another worker may be creating it at the same time)
+    os.makedirs(filePath, exist_ok=True)
+    
+    # Only ask for the feed if it has changed since the copy we already have, and ask for it compressed
+    state = feedState.setdefault(fileName, {})
+    headers = {'Accept-Encoding' : 'gzip, deflate'}
+    if (os.path.exists(fileName)):
+        if (state.get('etag') != None):
+            headers['If-None-Match'] = state['etag']
+        if (state.get('lastModified') != None):
+            headers['If-Modified-Since'] = state['lastModified']
+    
+    response = httpPool.get(feed['url'], headers)
+    if (response.status == 304):
+        response.close()
+        logger.info("Feed not modified, keeping existing file: "+fileName)
+        return False
+    elif (response.status != 200):
+        response.close()
+        raise Exception("Unexpected HTTP status "+str(response.status)+" loading feed "+feed['url'])
     
-    # Download the XML file from the URL and save locally
+    # Download the XML file from the URL in chunks, decompressing and writing each chunk straight to disk
     # We first save to a temp file then rename, as the rename is atomic and prevents issues with
     # Other processes attempting to read the file while downloading
-    with urllib.request.urlopen(feed['url']) as response, open(tempFile, 'wb') as outFile:
-        data = response.read() # a `bytes` object
-        outFile.write(data)
-        os.rename(tempFile, fileName)
-        logger.info("Loaded data to: "+fileName)
+    # The validators are only stored once the new copy is in place, so a failed download is not treated as not modified
+    digest = hashlib.md5()
+    etag = response.getheader('ETag')
+    lastModified = response.getheader('Last-Modified')
+    try:
+        with response, open(tempFile, 'wb') as outFile:
+            decoder = ContentDecoder.ContentDecoder(response.getheader('Content-Encoding'))
+            
+            for chunk in iter(lambda: response.read(config.Settings.DATA_FEED_CHUNK_SIZE), b''):
+                data = decoder.decompress(chunk)
+                digest.update(data)
+                outFile.write(data)
+            
+            data = decoder.flush()
+            digest.update(data)
+            outFile.write(data)
+    except:
+        if (os.path.exists(tempFile)):
+            os.remove(tempFile)
+        raise
+    
+    # Not all feeds support conditional requests, so also compare a digest of the content with the file already on disk
+    if (state.get('digest') == None and os.path.exists(fileName)):
+        state['digest'] = IPUtils.getFileDigest(fileName)
+    
+    if (digest.hexdigest() == state.get('digest')):
+        logger.info("Feed content unchanged, keeping existing file: "+fileName)
+        os.remove(tempFile)
+        state['etag'] = etag
+        state['lastModified'] = lastModified
+        return False
+    
+    os.rename(tempFile, fileName)
+    state['digest'] = digest.hexdigest()
+    state['etag'] = etag
+    state['lastModified'] = lastModified
+    logger.info("Loaded data to: "+fileName)
+    return True
+
+
+#
+# processNewSnapshot: Parses a newly loaded feed and writes its change log and/or binary cache
+#
+def processNewSnapshot(feed):
+    fileName = IPUtils.getDataFeedFileName(feed)
+    currentMatches = FeedParser.parseMatches(fileName)
+    
+    if (feed.get('changeLog')):
+        changes = FeedDiff.diffMatches(previousMatches.get(fileName, {}), currentMatches)
+        FeedDiff.writeChangeLog(fileName, changes)
+        previousMatches[fileName] = currentMatches
+        logger.info("Wrote "+str(len(changes))+" match changes for "+fileName)
+    
+    if (feed.get('binaryCache')):
+        FeedCache.writeFeedCache(fileName, currentMatches, feedState[fileName]['digest'])
+        logger.info("Wrote binary cache of "+str(len(currentMatches))+" matches to "+FeedCache.getFeedCacheFileName(fileName))
+
+
+#
+# loadAndCheckDataFeed: Loads a feed, archiving it in archive mode and writing its change log and binary cache if it has them.
+#                       If archiving or writing these fails, they are retried on the next load even if the feed has not
+#                       changed. If the feed is used to detect live matches in adaptive mode, returns the match activity it 
+#                       shows (None otherwise, or if the feed has not changed since it was last checked)
+#
+def loadAndCheckDataFeed(feed):
+    # The first time we see a feed with a change log, the copy already on disk is the previous snapshot
+    fileName = IPUtils.getDataFeedFileName(feed)
+    if (feed.get('changeLog') and fileName not in previousMatches and os.path.exists(fileName)):
+        try:
+            previousMatches[fileName] = FeedParser.parseMatches(fileName)
+        except Exception:
+            logger.warning("Unable to parse existing copy of "+fileName+", every match will be logged as new: "+traceback.format_exc())
+            previousMatches[fileName] = {}
+    
+    changed = loadDataFeed(feed)
+    state = feedState[fileName]
+    if (changed):
+        state['unarchived'] = args.archive
+        state['unprocessed'] = bool(feed.get('changeLog') or feed.get('binaryCache'))
+    
+    # The raw snapshot is archived before it is parsed, so it is archived even if it cannot be parsed
+    if (state.get('unarchived')):
+        length = FeedArchive.archiveSnapshot(fileName)
+        state['unarchived'] = False
+        logger.info("Archived snapshot of "+fileName+" ("+str(length)+" bytes compressed)")
+    
+    if (state.get('unprocessed')):
+        processNewSnapshot(feed)
+        state['unprocessed'] = False
+    
+    if (args.adaptive and feed.get('detectsLiveMatches') and (changed or matchActivity == None)):
+        return FeedParser.getMatchActivity(IPUtils.getDataFeedFileName(feed))
+    
+    return None
+
+
+#
+# getFeedInterval: Returns the interval (in seconds) at which a feed should be loaded
+#
+def getFeedInterval(feed):
+    if (args.adaptive and feed.get('adaptive')):
+        return config.Settings.dataFeedAdaptiveInterval['live' if matchesLive else 'idle']
+    
+    return feed.get('interval', config.Settings.dataFeedInterval[feed['type']])
+
+
+#
+# updateMatchesLive: Works out whether any match is in progress or about to kick off. When matches go live, any adaptive
+#                    feeds waiting on the idle interval are brought forward to load straight away
+#
+def updateMatchesLive(now):
+    global matchesLive
+    
+    if (not args.adaptive or matchActivity == None):
+        return
+    
+    (liveMatches, kickoffTimes) = matchActivity
+    window = config.Settings.DATA_FEED_KICKOFF_WINDOW
+    kickoffIndex = bisect.bisect_left(kickoffTimes, now - window)
+    kickoffSoon = kickoffIndex < len(kickoffTimes) and kickoffTimes[kickoffIndex] <= now + window
+    live = liveMatches > 0 or kickoffSoon
+    
+    if (live == matchesLive):
+        return
+    
+    matchesLive = live
+    logger.info(("Matches are live or about to kick off" if live else "No matches are live")+" ("+str(liveMatches)+" in progress), loading adaptive feeds every "+
+                str(config.Settings.dataFeedAdaptiveInterval['live' if live else 'idle'])+" seconds")
+    
+    if (live):
+        for scheduleIndex in range(len(schedule)):
+            (dueTime, feedIndex, slotTime) = schedule[scheduleIndex]
+            if (feeds[feedIndex].get('adaptive') and dueTime > now):
+                schedule[scheduleIndex] = (now, feedIndex, now)
+        heapq.heapify(schedule)
+
+
+#
+# scheduleFeed: Adds a feed to the schedule for the given cadence slot, with a random jitter if the feed has one
+#
+def scheduleFeed(feedIndex, slotTime):
+    jitter = feeds[feedIndex].get('jitter', config.Settings.DATA_FEED_JITTER)
+    heapq.heappush(schedule, (slotTime + random.uniform(0, jitter), feedIndex, slotTime))
+
+
+#
+# startDueFeeds: Submits every feed that is due to the worker pool
+#
+def startDueFeeds(now):
+    while (len(schedule) > 0 and schedule[0][0] <= now):
+        (dueTime, feedIndex, slotTime) = heapq.heappop(schedule)
+        future = executor.submit(loadAndCheckDataFeed, feeds[feedIndex])
+        loadsInProgress[future] = (feedIndex, slotTime, dueTime)
+
+
+#
+# rescheduleFeed: Schedules the next load of a feed once the current one has finished. Successful loads keep a fixed
+#                 cadence from the feed's slot (rather than from when the load finished) so the period does not drift.
+#                 Failed loads back off exponentially, affecting only the feed that failed
+#
+def rescheduleFeed(future, now):
+    (feedIndex, slotTime, dueTime) = loadsInProgress.pop(future)
+    
+    # The feed is always put back on the schedule, so an error working out its next slot can never stop it being loaded.
+    # If that happens it is retried after the longest backoff
+    nextSlotTime = now + config.Settings.DATA_FEED_MAX_BACKOFF
+    try:
+        nextSlotTime = getNextSlotTime(future, feedIndex, slotTime, dueTime, now)
+    finally:
+        scheduleFeed(feedIndex, nextSlotTime)
+
+
+#
+# getNextSlotTime: Returns the time of the next slot to load a feed in, once the current load has finished
+#
+def getNextSlotTime(future, feedIndex, slotTime, dueTime, now):
+    global matchActivity
+    feed = feeds[feedIndex]
+    interval = getFeedInterval(feed)
+    
+    try:
+        activity = future.result()
+    except Exception:
+        feedFailures[feedIndex] = feedFailures.get(feedIndex, 0) + 1
+        backoff = min(interval * (2 ** feedFailures[feedIndex]), config.Settings.DATA_FEED_MAX_BACKOFF)
+        logger.error("Failed to load feed "+feed['url']+" ("+str(feedFailures[feedIndex])+" consecutive failures), retrying in "+
+                     str(backoff)+" seconds: "+traceback.format_exc())
+        return now + backoff
+    
+    feedFailures.pop(feedIndex, None)
+    logLoadTime(feed, dueTime, now, interval)
+    
+    if (activity != None):
+        matchActivity = activity
+        updateMatchesLive(now)
+        interval = getFeedInterval(feed)
+    
+    # Move on to the next slot, skipping any slots we have missed if the load overran
+    nextSlotTime = slotTime + interval
+    if (nextSlotTime <= now):
+        missedSlots = int((now - nextSlotTime) // interval) + 1
+        logger.warning("Skipping "+str(missedSlots)+" missed load(s) of "+feed['fileName']+" for "+feed['competition'])
+        nextSlotTime += missedSlots * interval
+    
+    return nextSlotTime
+
+
+#
+# getInvalidIntervals: Returns a description of each interval that a feed could be loaded at which is not greater than 0
+#
+def getInvalidIntervals(feed):
+    intervals = {'interval' : feed.get('interval', config.Settings.dataFeedInterval[feed['type']])}
+    if (feed.get('adaptive')):
+        intervals.update({'adaptive '+state+' interval' : interval for state, interval in config.Settings.dataFeedAdaptiveInterval.items()})
+    
+    return [name+"="+str(interval) for name, interval in intervals.items() if not (interval > 0)]
+
+
+#
+# logLoadTime: Logs how long a feed took to load, from when it was due, compared with its interval, warning if we are falling behind
+#
+def logLoadTime(feed, dueTime, now, interval):
+    loadTime = now - dueTime
+    loadMessage = ("Feed "+feed['fileName']+" for "+feed['competition']+" loaded "+"{:.2f}".format(loadTime)+" seconds after it was due ("+
+                   "{:.0f}".format(100 * loadTime / interval)+"% of "+str(interval)+" second interval)")
+    
+    if (loadTime > interval):
+        logger.warning(loadMessage+". Loading is falling behind the feed interval")
+    else:
+        logger.info(loadMessage)
     
     
 
@@ -66,26 +359,50 @@ def loadDataFeed(feed):
 
 logger.info("STARTING")
 
+# Schedule all feeds of the given type to load straight away
+feeds = [feed for feed in config.Settings.dataFeeds if (args.type == 'all' or feed['type'] == args.type)]
+if (len(feeds) == 0):
+    logger.info("No feeds of type "+args.type+" configured, STOPPING")
+    exit()
+
+# Every interval a feed can be loaded at must be greater than 0, or it could never be rescheduled
+invalidFeeds = False
+for feed in feeds:
+    invalidIntervals = getInvalidIntervals(feed)
+    if (len(invalidIntervals) > 0):
+        logger.error("Feed "+feed['fileName']+" for "+feed['competition']+" has intervals that are not greater than 0: "+", ".join(invalidIntervals))
+        invalidFeeds = True
+if (invalidFeeds):
+    logger.info("Invalid feed intervals in config.Settings, STOPPING")
+    exit()
+
+startTime = time.time()
+for feedIndex in range(len(feeds)):
+    scheduleFeed(feedIndex, startTime)
+
 while True:
     try:
-        # Cycle through all feeds of the given type and load them
-        for feed in config.Settings.dataFeeds:
-            if feed['type'] == args.type:
-                loadDataFeed(feed)
-    
-        logger.info("Sleeping for "+str(config.Settings.dataFeedInterval[args.type])+" seconds")
-        time.sleep(config.Settings.dataFeedInterval[args.type])
+        now = time.time()
+        updateMatchesLive(now)
+        startDueFeeds(now)
+        
+        # Wait until either a load finishes or the next feed is due
+        timeout = (max(0, schedule[0][0] - now) if len(schedule) > 0 else None)
+        if (len(loadsInProgress) > 0):
+            (done, notDone) = concurrent.futures.wait(loadsInProgress, timeout=timeout, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                rescheduleFeed(future, time.time())
+        else:
+            time.sleep(timeout)
     
     except (KeyboardInterrupt, SystemExit):
         logger.info("Received KeyboardInterrupt/SystemExit")
+        executor.shutdown(wait=False)
+        httpPool.close()
+        logger.info("STOPPING")
         exit()
     
     except Exception:
-        # Catch any exceptions and retry on next run
+        # Catch any exceptions and carry on with the schedule
         logger.error("Caught Exception: "+traceback.format_exc()+"\n"+str(sys.exc_info()[0]))
-        time.sleep(config.Settings.dataFeedInterval[args.type]) 
-        
-    finally:
-        logger.info("STOPPING")
-
-
+        time.sleep(1)
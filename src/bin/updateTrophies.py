@@ -4,13 +4,32 @@
 
 Description: Process user trophies 
 
+Trophies can be processed for a single game, or for a batch of games in one run, in which case each trophy is 
+processed for all of the games at once
+   e.g. updateTrophies.py prod 101
+        updateTrophies.py prod 101,104-110
+
+With -w, every game that has completed since the last run with -w is processed. The watermark is the highest game_id
+below which every game has finished, so games that complete out of order are not missed. The complete games above it
+that have already been processed are stored with it, so they are not processed again while an earlier game is unfinished
+   e.g. updateTrophies.py prod -w
+
+When there is no stored watermark, the first run with -w starts from the highest game that has already completed, so
+only games completing after it are processed (rather than every game in history). To start from an earlier game instead,
+give the first game_id to process with -g, which replaces any stored watermark
+   e.g. updateTrophies.py prod -w -g 1200
+
 '''
 
 import argparse
+import concurrent.futures
+import json
 import logging
 import os
 import sys
 import inspect
+import queue
+import traceback
 import pymysql            # MySQL DB connection
 
 # Add the parent directory to sys.path so we can import local modules
@@ -20,7 +39,9 @@ sys.path.insert(0,parentdir)
 
 # Import local modules
 import config.Connections
+import config.Settings
 import util.IPUtils as IPUtils
+import util.TrophyCounters as TrophyCounters
 import metadata.State
 import metadata.Trophy
 import metadata.GameType
@@ -33,10 +54,21 @@ scriptName = str(os.path.basename(__file__)).replace(".py", "")
 # Parse command line arguments
 parser = argparse.ArgumentParser()
 parser.add_argument("env", choices=['local', 'dev', 'prod'], metavar="env", help="Environment (local/dev/prod)")
-parser.add_argument("game_id", type=int, help="ID of game for which you want to process trophies")
+parser.add_argument("game_id", nargs='?', help="ID of game for which you want to process trophies, or a comma separated list/range of IDs (e.g. 101,104-110)")
+parser.add_argument("-w", "--sinceWatermark", help="Process every game that has completed since the last run with -w", action="store_true")
+parser.add_argument("-g", "--fromGameId", type=int, help="With -w, process every complete game from this game_id on, instead of those since the stored watermark")
+parser.add_argument("-s", "--setBased", help="Grant each trophy to all of its new winners at once, with multi-row inserts in a single transaction", action="store_true")
+parser.add_argument("-t", "--threads", type=int, default=config.Settings.TROPHY_RULE_THREADS, help="Number of trophy rules to find the winners of at once, each on its own DB connection (1 = one after another)")
+parser.add_argument("-c", "--counters", help="Check the Banked 3 Times and Invited 5 People trophies against per-user counters kept up to date incrementally, instead of counting each user's whole history", action="store_true")
+parser.add_argument("-r", "--rebuildCounters", help="Rebuild the per-user counters used by -c from scratch", action="store_true")
 parser.add_argument("-d", "--debug", help="Debug mode", action="store_true")
 args = parser.parse_args()
 
+if ((args.game_id == None) == (not args.sinceWatermark)):
+    parser.error("Either game_id or -w must be given")
+if (args.fromGameId != None and not args.sinceWatermark):
+    parser.error("-g can only be used with -w")
+
 # Get logger
 loggingLevel = (logging.DEBUG if args.debug else logging.INFO)
 logger = IPUtils.getLogger(scriptName, loggingLevel)
@@ -49,39 +81,160 @@ db.autocommit(1)
 
 ############################### GLOBAL VARIABLES ############################### 
 
-# user_id -> [list of user trophies (None if user has no trophies)]
+# user_id -> bitmask of the user's trophies, with bit (1 << trophy_id) set for each trophy they have (0 if user has no trophies)
 userTrophies = {}
 
+# Per-user bank and invite counters, if checking history based trophies with -c
+trophyCounters = None
+
 
 ################################## FUNCTIONS ################################### 
 
 #
-# getGameState: returns the state of the current game
+# parseGameIds: Returns the sorted list of game IDs in a comma separated list of IDs and ranges of IDs, e.g. 101,104-110
+#
+def parseGameIds(gameIdsArg):
+    game_ids = set()
+    try:
+        for part in gameIdsArg.split(','):
+            if ('-' in part):
+                (first, last) = part.split('-')
+                game_ids.update(range(int(first), int(last) + 1))
+            else:
+                game_ids.add(int(part))
+    except ValueError:
+        parser.error("Invalid game_id "+gameIdsArg+", expected an ID or a comma separated list/range of IDs, e.g. 101,104-110")
+    return sorted(game_ids)
+
+
+#
+# getInParams: Returns the placeholders for a list of values in an IN clause, e.g. "%s, %s, %s"
+#
+def getInParams(values):
+    return ", ".join(["%s"] * len(values))
+
+
+#
+# getGameStates: returns game_id -> state for the given games
 #
-def getGameState(game_id):
+def getGameStates(game_ids):
     cursor =db.cursor()
-    cursor.execute("SELECT state FROM game WHERE game_id = %s", game_id)
-    (state,) = cursor.fetchone()
+    cursor.execute("SELECT game_id, state FROM game WHERE game_id IN ("+getInParams(game_ids)+")", game_ids)
+    gameStates = {row[0] : row[1] for row in cursor.fetchall()}
     cursor.close()
-    return state
+    return gameStates
 
 
 #
-# getGameCompId: Returns the comp_id for the given game
+# getGameCompIds: Returns the comp_ids of the given games
 #
-def getGameCompId(game_id):
+def getGameCompIds(conn, game_ids):
+    cursor =conn.cursor()
+    cursor.execute("SELECT DISTINCT competition FROM game WHERE game_id IN ("+getInParams(game_ids)+")", game_ids)
+    comp_ids = sorted(row[0] for row in cursor.fetchall())
+    cursor.close()
+    return comp_ids
+
+
+#
+# getWatermarkFileName: Returns the file that the watermark for this environment is stored in
+#
+def getWatermarkFileName():
+    return IPUtils.getUserPath(config.Settings.TROPHY_WATERMARK_FOLDER)+'/'+args.env+'.json'
+
+
+#
+# loadWatermark: Returns a tuple of (watermark game_id, below which every game has had its trophies processed (None if none
+#                stored), set of the game_ids above the watermark that have been processed)
+#
+def loadWatermark():
+    if (not os.path.exists(getWatermarkFileName())):
+        return (None, set())
+    with open(getWatermarkFileName()) as watermarkFile:
+        watermark = json.load(watermarkFile)
+    return (watermark['game_id'], set(watermark.get('processed', [])))
+
+
+#
+# saveWatermark: Stores the watermark game_id, and those of the processed games above it
+#
+def saveWatermark(game_id, processedGameIds):
+    processedGameIds = sorted(processedGameId for processedGameId in processedGameIds if processedGameId > game_id)
+    os.makedirs(os.path.dirname(getWatermarkFileName()), exist_ok=True)
+    tempFile = getWatermarkFileName()+'.tmp'
+    with open(tempFile, 'w') as watermarkFile:
+        json.dump({'game_id' : game_id, 'processed' : processedGameIds}, watermarkFile)
+    os.rename(tempFile, getWatermarkFileName())
+    logger.info("Saved watermark game_id="+str(game_id)+", with "+str(len(processedGameIds))+" processed games above it")
+
+
+#
+# getHighestCompleteGameId: Returns the game_id of the highest COMPLETE game (0 if there are none)
+#
+def getHighestCompleteGameId():
     cursor =db.cursor()
-    cursor.execute("SELECT competition FROM game WHERE game_id = %s", game_id)
-    (comp_id,) = cursor.fetchone()
+    cursor.execute("SELECT MAX(game_id) FROM game WHERE state = %s", metadata.State.COMPLETE)
+    (game_id,) = cursor.fetchone()
     cursor.close()
-    return comp_id
+    return (game_id or 0)
 
 
 #
-# getCompState: returns the state of the current competition
+# getCompleteGamesSince: Returns the IDs of the COMPLETE games with a game_id above the watermark
 #
-def getCompState(comp_id):
+def getCompleteGamesSince(watermark):
     cursor =db.cursor()
+    cursor.execute("SELECT game_id FROM game WHERE game_id > %s AND state = %s ORDER BY game_id", (watermark, metadata.State.COMPLETE))
+    game_ids = [row[0] for row in cursor.fetchall()]
+    cursor.close()
+    return game_ids
+
+
+#
+# getNewWatermark: Returns the new watermark after processing games above the old one. This is just below the first game
+#                  that has not yet finished, as it has still to be processed when it completes
+#
+def getNewWatermark(watermark, game_ids):
+    unfinishedStates = (metadata.State.INACTIVE, metadata.State.PREPLAY, metadata.State.TRANSITION, metadata.State.INPLAY, metadata.State.SUSPENDED)
+    cursor =db.cursor()
+    cursor.execute("SELECT MIN(game_id) FROM game WHERE game_id > %s AND state IN ("+getInParams(unfinishedStates)+")", 
+                   [watermark] + list(unfinishedStates))
+    (firstUnfinishedGameId,) = cursor.fetchone()
+    cursor.close()
+    
+    if (firstUnfinishedGameId != None):
+        return firstUnfinishedGameId - 1
+    return max([watermark] + game_ids)
+
+
+#
+# getCountersFileName: Returns the name of the per-user counters file for this environment
+#
+def getCountersFileName():
+    return IPUtils.getUserPath(config.Settings.TROPHY_COUNTERS_FOLDER)+'/'+args.env+'_counters.sqlite'
+
+
+#
+# getCounterWinners: Returns users who entered these games whose count (stored counter plus deltaSql's count since the
+#                    counter's high-water mark) is at least minCount. deltaSql takes the high-water mark then the game_ids
+#
+def getCounterWinners(conn, game_ids, counter, hwmKey, deltaSql, minCount):
+    cursor = conn.cursor()
+    cursor.execute("SELECT DISTINCT user FROM game_entry WHERE game IN ("+getInParams(game_ids)+")", game_ids)
+    entrants = [row[0] for row in cursor.fetchall()]
+    cursor.execute(deltaSql, [trophyCounters.getHighWaterMark(hwmKey)] + list(game_ids))
+    deltas = {row[0] : int(row[1] or 0) for row in cursor.fetchall()}
+    cursor.close()
+
+    counts = trophyCounters.getCounts(counter, entrants)
+    return [user_id for user_id in entrants if (counts.get(user_id, 0) + deltas.get(user_id, 0)) >= minCount]
+
+
+#
+# getCompState: returns the state of the current competition
+#
+def getCompState(conn, comp_id):
+    cursor =conn.cursor()
     cursor.execute("SELECT state FROM competition WHERE comp_id = %s", comp_id)
     (state,) = cursor.fetchone()
     cursor.close()
@@ -89,83 +242,97 @@ def getCompState(comp_id):
 
 
 #
-# loadUserTrophies: populates a mapping of users to a list of their trophies
+# loadUserTrophies: populates a mapping of users to their trophies, for the users who entered any of the games
 #
-def loadUserTrophies(game_id):
-    loadUserTrophySql = '''SELECT ge.user, ut.`trophy`
-                            FROM game_entry ge LEFT JOIN user_trophy ut ON ge.user = ut.user
-                            WHERE ge.game = %s'''
+def loadUserTrophies(game_ids):
+    # BIT_OR ignores the NULL trophy of users with no trophies, giving 0
+    loadUserTrophySql = '''SELECT entrants.user, BIT_OR(1 << ut.`trophy`)
+                            FROM (SELECT DISTINCT ge.user FROM game_entry ge WHERE ge.game IN ('''+getInParams(game_ids)+''')) AS entrants 
+                                LEFT JOIN user_trophy ut ON entrants.user = ut.user
+                            GROUP BY entrants.user'''
     cursor = db.cursor()
-    cursor.execute(loadUserTrophySql, game_id)
+    cursor.execute(loadUserTrophySql, game_ids)
     for row in cursor.fetchall():
-        if (userTrophies.get(row[0]) != None):
-            userTrophies[row[0]].append(row[1])
-        else:
-            if (row[1] != None):
-                userTrophies[row[0]] = [row[1]]
-            else:
-                userTrophies[row[0]] = None
+        userTrophies[row[0]] = int(row[1])
     cursor.close()
     
 
 #
-# loadSpecificUserTrophies: populates map of users to list of trophies for a specific user
+# loadSpecificUserTrophies: populates map of users to their trophies for specific users
 #
-def loadSpecificUserTrophies(user_id):
-    loadSpecificUserTrophySql = "SELECT user, trophy From user_trophy WHERE user = %s"
+def loadSpecificUserTrophies(user_ids):
+    if (len(user_ids) == 0):
+        return
+    
+    loadSpecificUserTrophySql = "SELECT user, BIT_OR(1 << trophy) From user_trophy WHERE user IN ("+getInParams(user_ids)+") GROUP BY user"
     cursor = db.cursor()
-    cursor.execute(loadSpecificUserTrophySql, user_id)
+    cursor.execute(loadSpecificUserTrophySql, user_ids)
     for row in cursor.fetchall():
-        if (userTrophies.get(row[0]) != None):
-            userTrophies[row[0]].append(row[1])
-        else:
-            if (row[1] != None):
-                userTrophies[row[0]] = [row[1]]
-            else:
-                userTrophies[row[0]] = None
+        userTrophies[row[0]] = int(row[1])
     cursor.close()
+
+
+#
+# hasTrophy: Returns True if the user has the trophy
+#
+def hasTrophy(user_id, trophy_id):
+    return ((userTrophies.get(user_id, 0) & (1 << trophy_id)) != 0)
+
+
+#
+# addToUserTrophies: Records that the user has the trophy
+#
+def addToUserTrophies(user_id, trophy_id):
+    userTrophies[user_id] = userTrophies.get(user_id, 0) | (1 << trophy_id)
     
     
 #
-# updateFirstGlobalWinTrophy: Finds the global winner(s) for this game and gives users 
-#                             the trophy if they don't already have it
+# getGlobalWinWinners: Returns the global winner(s) of these games
 # 
-def updateFirstGlobalWinTrophy(game_id):
-    # Find the winning users in global pool for this game
-    getGameGlobalWinnerSql = "SELECT `user` FROM global_game_leaderboard ggl WHERE ggl.game = %s AND rank = 1"
-    cursor = db.cursor()
-    cursor.execute(getGameGlobalWinnerSql, game_id)
-    for row in cursor.fetchall():
-        grantUserTrophyIfNew(row[0], metadata.Trophy.GLOBAL_WIN)
+def getGlobalWinWinners(conn, game_ids):
+    # Find the winning users in global pool for these games
+    getGameGlobalWinnerSql = "SELECT `user` FROM global_game_leaderboard ggl WHERE ggl.game IN ("+getInParams(game_ids)+") AND rank = 1"
+    cursor = conn.cursor()
+    cursor.execute(getGameGlobalWinnerSql, game_ids)
+    winners = [row[0] for row in cursor.fetchall()]
     cursor.close()
+    return winners
             
             
 #
-# updateFirstCompWinTrophy: If competition is complete, grants trophy to the winner
+# getCompWinWinners: Returns the winners of each competition of these games that is complete
+#
+def getCompWinWinners(conn, game_ids):
+    winners = []
+    for comp_id in getGameCompIds(conn, game_ids):
+        winners.extend(getCompWinnersIfComplete(conn, comp_id))
+    return winners
+
+
 #
-def updateFirstCompWinTrophy(game_id):
-    # If the competition is complete, grant the competition win to the winner
-    comp_id = getGameCompId(game_id)
-    compState = getCompState(comp_id)
+# getCompWinnersIfComplete: If competition is complete, returns the winners of it
+#
+def getCompWinnersIfComplete(conn, comp_id):
+    # If the competition is complete, the competition win goes to the winner
+    compState = getCompState(conn, comp_id)
     if (compState == metadata.State.COMPLETE):
         # Process trophy as competition is complete
         getCompWinnersSql = "SELECT `user` FROM global_comp_leaderboard gcl WHERE gcl.competition = %s AND rank = 1"
-        cursor = db.cursor()
+        cursor = conn.cursor()
         cursor.execute(getCompWinnersSql, comp_id)
-        for row in cursor.fetchall():
-            # The competition winner may not necessarily have entered this game, so load this user's trophies
-            loadSpecificUserTrophies(row[0])
-            grantUserTrophyIfNew(row[0], metadata.Trophy.COMPETITION_WIN)
+        winners = [row[0] for row in cursor.fetchall()]
         cursor.close()
+        return winners
     else:
         logger.info("Competition "+str(comp_id)+" is not complete, state="+str(compState)+". Not processing First Comp Win trophy")
+        return []
 
 
 #
-# updateFirstFriendWinTrophy: Finds winners of all pools, and checks if this is their first friend pool win
+# getFriendWinWinners: Returns the winners of all pools of these games that are big enough for the friend win trophy
 #
-def updateFirstFriendWinTrophy(game_id):
-    # Get all winners of friend pools for this game
+def getFriendWinWinners(conn, game_ids):
+    # Get all winners of friend pools for these games
     getPoolGameWinnersSql = '''SELECT 
                                 pgl.user,
                                 p.num_players,
@@ -173,9 +340,10 @@ def updateFirstFriendWinTrophy(game_id):
                             FROM 
                                 pool_game_leaderboard pgl 
                                 LEFT JOIN pool p on pgl.pool = p.pool_id
-                            WHERE pgl.game = %s AND pgl.rank = 1'''
-    cursor = db.cursor()
-    cursor.execute(getPoolGameWinnersSql, game_id)
+                            WHERE pgl.game IN ('''+getInParams(game_ids)+") AND pgl.rank = 1"
+    cursor = conn.cursor()
+    cursor.execute(getPoolGameWinnersSql, game_ids)
+    winners = []
     for row in cursor.fetchall():
         if (row[1] < config.Settings.MIN_USERS_IN_POOL_FOR_FRIEND_WIN_TROPHY):
             logger.info("Not processing "+metadata.Trophy.trophyNames[metadata.Trophy.FRIEND_WIN]+" Trophy for user "+str(row[0])+" in pool "+str(row[2])+" as it only has "+str(row[1])+
@@ -183,26 +351,36 @@ def updateFirstFriendWinTrophy(game_id):
         else:
             logger.info("User "+str(row[0])+" is rank 1 in pool "+str(row[2])+" which has "+str(row[1])+
                         " members. Checking if user has already been awarded "+metadata.Trophy.trophyNames[metadata.Trophy.FRIEND_WIN]+" Trophy")
-            grantUserTrophyIfNew(row[0], metadata.Trophy.FRIEND_WIN)
+            winners.append(row[0])
     cursor.close()
+    return winners
 
 
 #
-# updateFirstH2HWinTrophy: Grants H2H win trophy to all users who won their H2H in this game
+# getH2HWinWinners: Returns all users who won their H2H in these games
 #
-def updateFirstH2HWinTrophy(game_id):
-    # Find all users who won their H2H in this game
-    cursor = db.cursor()
-    cursor.execute("SELECT user FROM game_entry WHERE game = %s AND h2h_winnings > 0", (game_id))
-    for row in cursor.fetchall():
-        grantUserTrophyIfNew(row[0], metadata.Trophy.H2H_WIN)
+def getH2HWinWinners(conn, game_ids):
+    # Find all users who won their H2H in these games
+    cursor = conn.cursor()
+    cursor.execute("SELECT DISTINCT user FROM game_entry WHERE game IN ("+getInParams(game_ids)+") AND h2h_winnings > 0", game_ids)
+    winners = [row[0] for row in cursor.fetchall()]
     cursor.close()
+    return winners
     
     
 #
-# processBanked3TimesTrophy: Finds all users who entered this game and have banked 3 or more times
-#
-def processBanked3TimesTrophy(game_id):
+# getBanked3TimesWinners: Returns all users who entered these games and have banked 3 or more times
+#
+def getBanked3TimesWinners(conn, game_ids):
+    if (trophyCounters != None):
+        # Entries above the high-water mark may be in games still in play, so are counted live
+        banksSinceSql = '''SELECT ge.user, SUM(ps.`cashed_out`)
+                          FROM game_entry ge JOIN period_selection ps ON ge.`game_entry_id` = ps.`game_entry`
+                          WHERE ge.`game_entry_id` > %s 
+                          AND ge.`user` IN (SELECT user FROM game_entry WHERE game IN ('''+getInParams(game_ids)+'''))
+                          GROUP BY ge.user'''
+        return getCounterWinners(conn, game_ids, 'banks', 'game_entry_id', banksSinceSql, 3)
+    
     usersWhoHaveBanked3TimesSql = '''SELECT 
                                         numBanksForUsersInGame.user
                                     FROM
@@ -213,61 +391,66 @@ def processBanked3TimesTrophy(game_id):
                                             game_entry ge 
                                             LEFT JOIN period_selection ps ON ge.`game_entry_id` = ps.`game_entry`
                                         WHERE
-                                            ge.`user` IN (SELECT user FROM game_entry ge WHERE ge.`game` = %s)
+                                            ge.`user` IN (SELECT user FROM game_entry ge WHERE ge.`game` IN ('''+getInParams(game_ids)+'''))
                                         GROUP BY ge.user) as numBanksForUsersInGame
                                     WHERE numBanksForUsersInGame.num_banks > 2'''
-    cursor = db.cursor()
-    cursor.execute(usersWhoHaveBanked3TimesSql, game_id)
-    for row in cursor.fetchall():
-        grantUserTrophyIfNew(row[0], metadata.Trophy.BANKED_3_TIMES)
+    cursor = conn.cursor()
+    cursor.execute(usersWhoHaveBanked3TimesSql, game_ids)
+    winners = [row[0] for row in cursor.fetchall()]
     cursor.close()
+    return winners
     
 
 #
-# processPlayed10GamesTrophy: Grants trophy to all users in this game who have played 10 games or more
+# getPlayed10GamesWinners: Returns all users in these games who have played 10 games or more
 #
-def processPlayed10GamesTrophy(game_id):
-    played10GamesSql = '''SELECT
+def getPlayed10GamesWinners(conn, game_ids):
+    played10GamesSql = '''SELECT DISTINCT
                                ge.user as 'user'
                         FROM
                             game_entry ge 
                             LEFT JOIN user_stats us ON ge.`user` = us.`user`
-                        WHERE ge.`game` = %s AND us.total_games_played > 9'''
-    cursor = db.cursor()
-    cursor.execute(played10GamesSql, game_id)
-    for row in cursor.fetchall():
-        grantUserTrophyIfNew(row[0], metadata.Trophy.PLAYED_10_GAMES)
+                        WHERE ge.`game` IN ('''+getInParams(game_ids)+") AND us.total_games_played > 9"
+    cursor = conn.cursor()
+    cursor.execute(played10GamesSql, game_ids)
+    winners = [row[0] for row in cursor.fetchall()]
     cursor.close()
+    return winners
 
 
 #
-# processPlayed50GamesTrophy: Grants trophy to all users in this game who have played 50 games or more
+# getPlayed50GamesWinners: Returns all users in these games who have played 50 games or more
 #
-def processPlayed50GamesTrophy(game_id):
-    played50GamesSql = '''SELECT
+def getPlayed50GamesWinners(conn, game_ids):
+    played50GamesSql = '''SELECT DISTINCT
                                ge.user as 'user'
                         FROM
                             game_entry ge 
                             LEFT JOIN user_stats us ON ge.`user` = us.`user`
-                        WHERE ge.`game` = %s AND us.total_games_played > 49'''
-    cursor = db.cursor()
-    cursor.execute(played50GamesSql, game_id)
-    for row in cursor.fetchall():
-        grantUserTrophyIfNew(row[0], metadata.Trophy.PLAYED_50_GAMES)
+                        WHERE ge.`game` IN ('''+getInParams(game_ids)+") AND us.total_games_played > 49"
+    cursor = conn.cursor()
+    cursor.execute(played50GamesSql, game_ids)
+    winners = [row[0] for row in cursor.fetchall()]
     cursor.close()
+    return winners
     
     
 #
-# processPerfectGameTrophy: Finds any users in this game who got all selections correct and awards trophy
+# getPerfectGameWinners: Returns any users in these games who got all selections correct in a game
 #
-def processPerfectGameTrophy(game_id):
+def getPerfectGameWinners(conn, game_ids):
     # We do not process the Perfect Game trophy for Fantasy game type
-    gameDao = GameDao.GameDao(db)
-    gameType = gameDao.getGameType(game_id)
+    gameDao = GameDao.GameDao(conn)
+    perfectGameIds = []
+    for game_id in game_ids:
+        gameType = gameDao.getGameType(game_id)
+        if (gameType == metadata.GameType.FANTASY or gameType == metadata.GameType.QUIZ):
+            logger.info("Not processing "+metadata.Trophy.trophyNames[metadata.Trophy.PERFECT_GAME]+ " Trophy for game "+str(game_id)+" as this is a Fantasy or Quiz game type")
+        else:
+            perfectGameIds.append(game_id)
     
-    if (gameType == metadata.GameType.FANTASY or gameType == metadata.GameType.QUIZ):
-        logger.info("Not processing "+metadata.Trophy.trophyNames[metadata.Trophy.PERFECT_GAME]+ " Trophy as this is a Fantasy or Quiz game type")
-        return
+    if (len(perfectGameIds) == 0):
+        return []
     
     perfectGameSql = '''SELECT
                             userCorrectAnswers.user
@@ -280,40 +463,145 @@ def processPerfectGameTrophy(game_id):
                                 game_entry ge 
                                 LEFT JOIN period_selection ps ON ge.`game_entry_id` = ps.`game_entry`
                                 LEFT JOIN period p ON ps.`period` = p.`period_id`
-                            WHERE ge.`game` = %s
+                            WHERE ge.`game` IN ('''+getInParams(perfectGameIds)+''')
                             GROUP BY ge.user, ge.game) as userCorrectAnswers
                             LEFT JOIN
-                                (SELECT p.game as 'game', COUNT(1) as 'num_periods' FROM period p    WHERE p.`game` = %s) AS periods
+                                (SELECT p.game as 'game', COUNT(1) as 'num_periods' FROM period p    WHERE p.`game` IN ('''+getInParams(perfectGameIds)+''') GROUP BY p.game) AS periods
                                 ON userCorrectAnswers.game = periods.game
                         WHERE
                             userCorrectAnswers.correct_answers = periods.num_periods'''
-    cursor = db.cursor()
-    cursor.execute(perfectGameSql, (game_id, game_id))
-    for row in cursor.fetchall():
-        grantUserTrophyIfNew(row[0], metadata.Trophy.PERFECT_GAME)
+    cursor = conn.cursor()
+    cursor.execute(perfectGameSql, perfectGameIds + perfectGameIds)
+    winners = [row[0] for row in cursor.fetchall()]
     cursor.close()
+    return winners
     
 
 #
-# processInvited5UsersTrophy: Finds users in this game who have invited 5 users to join
+# getInvited5UsersWinners: Returns users in these games who have invited 5 users to join
 #
-def processInvited5UsersTrophy(game_id):
+def getInvited5UsersWinners(conn, game_ids):
+    if (trophyCounters != None):
+        invitesSinceSql = '''SELECT ui.source_user, COUNT(1)
+                            FROM user_invite ui
+                            WHERE ui.`user_invite_id` > %s 
+                            AND ui.source_user IN (SELECT user FROM game_entry WHERE game IN ('''+getInParams(game_ids)+'''))
+                            GROUP BY ui.source_user'''
+        return getCounterWinners(conn, game_ids, 'invites', 'user_invite_id', invitesSinceSql, 5)
+    
+    # Invites are counted distinctly as users who entered several of the games have a game_entry for each
     userInviteSql = '''SELECT users_invites.user
                         FROM
                             (SELECT
                                    ge.user as 'user',
-                                COUNT(ui.`user_invite_id`) as 'num_invites'
+                                COUNT(DISTINCT ui.`user_invite_id`) as 'num_invites'
                             FROM
                                 game_entry ge 
                                 LEFT JOIN user_invite ui ON ge.`user` = ui.source_user
-                            WHERE ge.`game` = %s
+                            WHERE ge.`game` IN ('''+getInParams(game_ids)+''')
                             GROUP BY ge.user) AS users_invites
                         WHERE users_invites.num_invites > 4'''
-    cursor = db.cursor()
-    cursor.execute(userInviteSql, game_id)
-    for row in cursor.fetchall():
-        grantUserTrophyIfNew(row[0], metadata.Trophy.INVITED_5_PEOPLE)
+    cursor = conn.cursor()
+    cursor.execute(userInviteSql, game_ids)
+    winners = [row[0] for row in cursor.fetchall()]
     cursor.close()
+    return winners
+
+
+# Trophy rules, in the order their grants are applied. Each rule's getWinners(conn, game_ids) reads (without writing) the 
+# users who have won the trophy in the games, whether or not they already have it, so rules can run concurrently
+trophyRules = [{'trophy' : metadata.Trophy.GLOBAL_WIN, 'getWinners' : getGlobalWinWinners},
+               {'trophy' : metadata.Trophy.COMPETITION_WIN, 'getWinners' : getCompWinWinners},
+               {'trophy' : metadata.Trophy.FRIEND_WIN, 'getWinners' : getFriendWinWinners},
+               {'trophy' : metadata.Trophy.H2H_WIN, 'getWinners' : getH2HWinWinners},
+               {'trophy' : metadata.Trophy.BANKED_3_TIMES, 'getWinners' : getBanked3TimesWinners},
+               {'trophy' : metadata.Trophy.PLAYED_10_GAMES, 'getWinners' : getPlayed10GamesWinners},
+               {'trophy' : metadata.Trophy.PLAYED_50_GAMES, 'getWinners' : getPlayed50GamesWinners},
+               {'trophy' : metadata.Trophy.PERFECT_GAME, 'getWinners' : getPerfectGameWinners},
+               {'trophy' : metadata.Trophy.INVITED_5_PEOPLE, 'getWinners' : getInvited5UsersWinners}]
+
+
+#
+# runTrophyRule: Runs a trophy rule on a connection taken from the pool, returning its winners
+#
+def runTrophyRule(rule, connections, game_ids):
+    conn = connections.get()
+    try:
+        logger.info("Finding winners of "+metadata.Trophy.trophyNames[rule['trophy']]+" Trophy")
+        return rule['getWinners'](conn, game_ids)
+    finally:
+        connections.put(conn)
+
+
+#
+# findTrophyWinners: Runs every trophy rule for these games, concurrently on a pool of numThreads DB connections (or one 
+#                    after another on the main connection if numThreads is 1). Returns trophy_id -> winners
+#
+def findTrophyWinners(game_ids, numThreads):
+    connections = queue.Queue()
+    if (numThreads <= 1):
+        connections.put(db)
+        return {rule['trophy'] : runTrophyRule(rule, connections, game_ids) for rule in trophyRules}
+    
+    numConnections = min(numThreads, len(trophyRules))
+    try:
+        for i in range(numConnections):
+            conn = pymysql.connect(host=dbConfig['host'], port=dbConfig['port'], user=dbConfig['user'], passwd=dbConfig['pass'], db=dbConfig['db'])
+            conn.autocommit(1)
+            connections.put(conn)
+        
+        with concurrent.futures.ThreadPoolExecutor(max_workers=numConnections) as executor:
+            futures = {rule['trophy'] : executor.submit(runTrophyRule, rule, connections, game_ids) for rule in trophyRules}
+            return {trophy_id : future.result() for trophy_id, future in futures.items()}
+    finally:
+        while (not connections.empty()):
+            connections.get().close()
+
+
+#
+# applyTrophyGrants: Grants each trophy to its winners who do not already have it, in the order of the trophy rules
+#
+def applyTrophyGrants(winnersByTrophy):
+    for rule in trophyRules:
+        winners = winnersByTrophy[rule['trophy']]
+        logger.info("Processing "+metadata.Trophy.trophyNames[rule['trophy']]+" Trophy, "+str(len(winners))+" winners")
+        
+        # Winners may not necessarily have entered these games (e.g. competition winners), so load their trophies
+        loadSpecificUserTrophies(sorted({user_id for user_id in winners if user_id not in userTrophies}))
+        grantTrophy(winners, rule['trophy'])
+
+
+#
+# grantTrophy: Grants a trophy to each of the winners of it who do not already have it, either one at a time or, in set 
+#              based mode, all at once
+#
+def grantTrophy(user_ids, trophy_id):
+    if (args.setBased):
+        grantUserTrophiesIfNew(user_ids, trophy_id)
+    else:
+        for user_id in user_ids:
+            grantUserTrophyIfNew(user_id, trophy_id)
+
+
+#
+# grantUserTrophiesIfNew: Grants this trophy to all of the given users who do not already have it, in a single transaction
+#
+def grantUserTrophiesIfNew(user_ids, trophy_id):
+    newUserIds = []
+    numExistingHolders = 0
+    for user_id in set(user_ids):
+        if (hasTrophy(user_id, trophy_id)):
+            numExistingHolders += 1
+        else:
+            newUserIds.append(user_id)
+    
+    logger.info(str(len(newUserIds))+" users have won trophy "+str(trophy_id)+" for the first time, "+str(numExistingHolders)+" winners already have it")
+    if (len(newUserIds) == 0):
+        return
+    
+    if (addUserTrophies(sorted(newUserIds), trophy_id)):
+        for user_id in newUserIds:
+            addToUserTrophies(user_id, trophy_id)
 
 
 #
@@ -321,17 +609,11 @@ def processInvited5UsersTrophy(game_id):
 #
 def grantUserTrophyIfNew(user_id, trophy_id):
     # Grant those users the trophy if they have not yet achieved it
-    if (userTrophies.get(user_id) != None):
-        # User has existing trophies
-        if (trophy_id in userTrophies.get(user_id)):
-            logger.info("User "+str(user_id)+" already has trophy "+str(trophy_id))
-        else:
-            addUserTrophy(user_id, trophy_id)
-            userTrophies[user_id].append(trophy_id)
+    if (hasTrophy(user_id, trophy_id)):
+        logger.info("User "+str(user_id)+" already has trophy "+str(trophy_id))
     else:
-        # User has no existing trophies
         addUserTrophy(user_id, trophy_id)
-        userTrophies[user_id] = [trophy_id]
+        addToUserTrophies(user_id, trophy_id)
 
 
 #
@@ -355,6 +637,37 @@ def addUserTrophy(user_id, trophy_id):
     except pymysql.err.MySQLError:
         logger.error("Error when inserting motd")
 
+
+
+#
+# addUserTrophies: Adds a new trophy for each of the given users, and their motds, with multi-row inserts in a single 
+#                  transaction. Returns True if the trophies were added
+#
+def addUserTrophies(user_ids, trophy_id):
+    logger.info("Inserting trophy_id="+str(trophy_id)+" into DB for "+str(len(user_ids))+" users")
+    insertUserTrophySql = "INSERT INTO user_trophy(user, trophy) VALUES (%s, %s)"
+    message = "Congratulations, you have achieved the "+metadata.Trophy.trophyNames[trophy_id]+" Trophy!"
+    
+    db.begin()
+    try:
+        cursor = db.cursor()
+        cursor.executemany(insertUserTrophySql, [(user_id, trophy_id) for user_id in user_ids])
+        cursor.close()
+        
+        # Add MOTDs for users
+        motdDao = MotdDao.MotdDao(db)
+        numDuplicates = motdDao.createMany([(user_id, message) for user_id in user_ids])
+        if (numDuplicates > 0):
+            logger.error(str(numDuplicates)+" duplicate motds present, cannot insert them")
+        db.commit()
+        
+    except pymysql.err.MySQLError:
+        db.rollback()
+        logger.error("Error when inserting trophy_id="+str(trophy_id)+" for users, none have been granted it: "+traceback.format_exc())
+        return False
+    
+    return True
+
     
 #
 # closeConnections: Closes all connections - used before finishing script
@@ -363,6 +676,9 @@ def closeConnections():
     # Close DB Connection
     db.close()
     
+    if (trophyCounters != None):
+        trophyCounters.close()
+    
 #
 # closeConnectionsAndExit: Closes all connections and exits script - used when aborting script
 #
@@ -375,49 +691,60 @@ def closeConnectionsAndExit():
 
 logger.info("STARTING")
 
-# Only process trophies for games that have completed
-gameState = getGameState(args.game_id)
-if (gameState == metadata.State.COMPLETE):
-    logger.info("Game "+str(args.game_id)+" is complete, proceeding with processing of trophies")
+# Find the games to process
+if (args.sinceWatermark):
+    if (args.fromGameId != None):
+        (watermark, processedGameIds) = (args.fromGameId - 1, set())
+        logger.info("Starting from game_id="+str(args.fromGameId)+" instead of the stored watermark")
+    else:
+        (watermark, processedGameIds) = loadWatermark()
+        if (watermark == None):
+            watermark = getHighestCompleteGameId()
+            logger.info("No watermark stored, starting from the highest complete game_id="+str(watermark))
+    logger.info("Finding games that have completed since watermark game_id="+str(watermark))
+    gameIds = [gameId for gameId in getCompleteGamesSince(watermark) if gameId not in processedGameIds]
 else:
-    logger.info("Game "+str(args.game_id)+" is NOT complete. Current game state is "+str(gameState)+". Quitting processing of trophies")
+    gameIds = parseGameIds(args.game_id)
+
+# Only process trophies for games that have completed
+gameStates = (getGameStates(gameIds) if len(gameIds) > 0 else {})
+completeGameIds = []
+for gameId in gameIds:
+    if (gameStates.get(gameId) == metadata.State.COMPLETE):
+        logger.info("Game "+str(gameId)+" is complete, proceeding with processing of trophies")
+        completeGameIds.append(gameId)
+    else:
+        logger.info("Game "+str(gameId)+" is NOT complete. Current game state is "+str(gameStates.get(gameId))+". Not processing trophies for this game")
+
+if (len(completeGameIds) == 0):
+    logger.info("No complete games to process. Quitting processing of trophies")
+    if (args.sinceWatermark):
+        saveWatermark(getNewWatermark(watermark, sorted(processedGameIds)), processedGameIds)
     closeConnectionsAndExit()
     
     
-# Load user trophy data for the users who entered this game
-logger.info("Loading existing user trophies for users who have entered this game")
-loadUserTrophies(args.game_id)
+# Load user trophy data for the users who entered these games
+logger.info("Loading existing user trophies for users who have entered games "+str(completeGameIds))
+loadUserTrophies(completeGameIds)
 
 logger.debug("Loaded User Trophies: "+(str(userTrophies)))
 
 
-logger.info("Processing First Global Win Trophy")
-updateFirstGlobalWinTrophy(args.game_id)
-
-logger.info("Processing First Competition Win Trophy")
-updateFirstCompWinTrophy(args.game_id)
-
-logger.info("Processing First Friend Win Trophy")
-updateFirstFriendWinTrophy(args.game_id)
-
-logger.info("Processing First H2H Win Trophy")
-updateFirstH2HWinTrophy(args.game_id)
-
-logger.info("Processing Banked 3 Times Trophy")
-processBanked3TimesTrophy(args.game_id)
-
-logger.info("Processing Played 10 Games Trophy")
-processPlayed10GamesTrophy(args.game_id)
+# Bring the per-user counters up to date before the trophy rules read them
+if (args.counters):
+    trophyCounters = TrophyCounters.TrophyCounters(getCountersFileName(), args.rebuildCounters)
+    trophyCounters.refresh(db)
 
-logger.info("Processing Played 50 Games Trophy")
-processPlayed50GamesTrophy(args.game_id)
 
-logger.info("Processing Perfect Game Trophy")
-processPerfectGameTrophy(args.game_id)
+# Find the winners of every trophy, then grant the trophies to those who do not already have them
+winnersByTrophy = findTrophyWinners(completeGameIds, args.threads)
+applyTrophyGrants(winnersByTrophy)
 
-logger.info("Processing Invited 5 Users Trophy")
-processInvited5UsersTrophy(args.game_id)
 
+# Record that these games have been processed
+if (args.sinceWatermark):
+    processedGameIds.update(completeGameIds)
+    saveWatermark(getNewWatermark(watermark, sorted(processedGameIds)), processedGameIds)
 
 closeConnections()
 
@@ -15,11 +15,101 @@ WELCOME_EMAIL_CHECK_INTERVAL = 300
 # Minimum number of users in pool for the friend win trophy
 MIN_USERS_IN_POOL_FOR_FRIEND_WIN_TROPHY = 4
 
+# Watermarks (one per environment) of the games that updateTrophies.py -w has processed
+TROPHY_WATERMARK_FOLDER = '/var/tmp/{UserName}/inplayrs/data/trophies'
+
+# Local SQLite per-user bank and invite counters (one per environment) that updateTrophies.py -c checks trophies against
+TROPHY_COUNTERS_FOLDER = '/var/tmp/{UserName}/inplayrs/data/trophies'
+
+# Number of user_invite_ids below the high-water mark that are re-read on each refresh of the counters, to count invites 
+# committed after an earlier refresh read past their id
+TROPHY_COUNTER_INVITE_RESCAN = 1000
+
+# Number of trophy rules whose winners updateTrophies.py finds at once, each on its own DB connection
+TROPHY_RULE_THREADS = 4
+
+# Number of new players and data_source_mappings written together in each multi-row insert/transaction when importing team data
+IMPORT_BATCH_SIZE = 500
+
+# When importing team/player data, the data_source_mappings for the ids in each window of IMPORT_LOOKUP_WINDOW parsed
+# elements are fetched together (at most MAPPING_LOOKUP_BATCH_SIZE ids per query), and at most MAPPING_CACHE_SIZE mappings
+# per table are kept in memory
+IMPORT_LOOKUP_WINDOW = 200
+MAPPING_CACHE_SIZE = 50000
+MAPPING_LOOKUP_BATCH_SIZE = 1000
+
+# Local SQLite snapshots of each data source's data_source_mappings, which imports look mappings up in
+MAPPING_SNAPSHOT_FOLDER = '/var/tmp/{UserName}/inplayrs/data/mappings'
+
+# Pattern matching the id on the start tag of a player in goalserve's player files, used in streaming mode (bytes regex)
+PLAYER_ID_PATTERN = rb'''<player\s[^>]*?\bid=["'](\d+)["']'''
+
+# When importing team/player data on several processes, each process is given shards of about this many bytes of elements
+IMPORT_SHARD_SIZE = 4194304
+
+# Pattern matching the league ids of a team in goalserve's teams.xml, used when indexing teams by league (bytes regex)
+TEAM_INDEX_LEAGUE_PATTERN = rb'<league_id>\s*(\d+)\s*</league_id>'
+
+# Files in goalserve's players.zip archive that player data is imported from
+PLAYER_DATA_FILES = ('attackers.xml', 'defenders.xml', 'midfielders.xml', 'goalkeepers.xml')
+
+# Images imported with team/player data are decoded and saved by this many worker threads. At most IMAGE_QUEUE_SIZE images
+# wait to be saved at once, which caps the memory used while parsing gets ahead of saving
+IMAGE_WORKERS = 8
+IMAGE_QUEUE_SIZE = 100
+
+# Amazon S3 bucket that images are stored to
+S3_BUCKET = 'storage.inplayrs.com'
+
+# Manifest of the digests of images saved by previous imports, used to skip images that have not changed
+IMAGE_MANIFEST_FILE = '/var/tmp/{UserName}/inplayrs/data/images/manifest.json'
+
 # Folders to store data imported from feeds
 BASE_DATA_FOLDER = '/var/tmp/{UserName}/inplayrs/data'
 
-# Interval for which to load XML data feeds (in seconds)
+# Interval for which to load XML data feeds (in seconds). Used for any feed that does not specify its own 'interval'.
+# Feeds may also specify a 'jitter' (in seconds), up to which a random delay is added to each load so feeds sharing
+# an interval do not all hit the server at the same moment
 dataFeedInterval = {'preplay' : 600, 'inplay' : 10}
+DATA_FEED_JITTER = 0
+
+# In adaptive mode, feeds marked 'adaptive' are loaded at the 'live' interval while any match is in progress or due to kick
+# off within DATA_FEED_KICKOFF_WINDOW seconds, and at the 'idle' interval otherwise. Live matches are detected from the
+# feed marked 'detectsLiveMatches', whose kick-off times are in UTC plus GOALSERVE_UTC_OFFSET_HOURS
+dataFeedAdaptiveInterval = {'idle' : 120, 'live' : 5}
+DATA_FEED_KICKOFF_WINDOW = 900
+GOALSERVE_UTC_OFFSET_HOURS = 0
+
+# Feeds marked 'changeLog' have the matches that changed in each new snapshot appended to <fileName>.changes.jsonl,
+# which is rotated once it reaches this size (in bytes)
+DATA_FEED_CHANGE_LOG_MAX_BYTES = 100 * 1024 * 1024
+
+# Feeds marked 'binaryCache' also have their matches written to a compact binary file (<fileName>.bin) that can be read
+# without parsing XML, using util.FeedCache.FeedCacheReader
+
+# Feeds marked 'index' are loaded into the in-memory match index served by feedIndexServer.py on localhost:FEED_INDEX_PORT.
+# The server checks every FEED_INDEX_REFRESH_INTERVAL seconds for new copies of the feeds renamed into place by loadDataFeeds.py
+FEED_INDEX_PORT = 8765
+FEED_INDEX_REFRESH_INTERVAL = 1
+
+# In archive mode every new snapshot of a feed is gzip compressed (at this level) and appended to the feed's archive.
+# See util.FeedArchive
+DATA_FEED_ARCHIVE_COMPRESSION_LEVEL = 6
+
+# When a feed fails to load it is retried after its interval doubled for each consecutive failure, up to this many seconds
+DATA_FEED_MAX_BACKOFF = 600
+
+# Maximum number of data feeds to download at the same time (1 = download feeds one after another)
+DATA_FEED_WORKERS = 4
+
+# Size of the chunks (in bytes) read from the network and written to disk when downloading a data feed
+DATA_FEED_CHUNK_SIZE = 65536
+
+# Keep-alive connections are pooled and shared by all feeds on the same host. Pool size is the maximum number of
+# connections open to each host, and timeouts are in seconds
+DATA_FEED_POOL_SIZE = 4
+DATA_FEED_CONNECT_TIMEOUT = 5
+DATA_FEED_READ_TIMEOUT = 30
 
 dataFeeds = [
                 {
@@ -27,35 +117,49 @@ dataFeeds = [
                  'competition' : 'premier_league',
                  'fileName' : 'preplay_odds.xml',
                  'url' : 'http://www.goalserve.com/getfeed/5d9ac1a5a7c048809742407788fe4527/soccernew/england_shedule?odds=bet365',
-                 'type' : 'preplay'
+                 'type' : 'preplay',
+                 'binaryCache' : True,
+                 'index' : True
                  },
                 {
                  'category' : 'soccer',
                  'competition' : 'champions_league',
                  'fileName' : 'preplay_odds.xml',
                  'url' : 'http://www.goalserve.com/getfeed/5d9ac1a5a7c048809742407788fe4527/soccernew/eurocups_shedule?odds=bet365',
-                 'type' : 'preplay'
+                 'type' : 'preplay',
+                 'binaryCache' : True,
+                 'index' : True
                  },
                 {
                  'category' : 'soccer',
                  'competition' : 'all',
                  'fileName' : 'inplay_odds.xml',
                  'url' : 'http://www.goalserve.com/getfeed/5d9ac1a5a7c048809742407788fe4527/lines/soccer-inplay',
-                 'type' : 'inplay'
+                 'type' : 'inplay',
+                 'adaptive' : True,
+                 'changeLog' : True,
+                 'binaryCache' : True,
+                 'index' : True
                  },
                 {
                  'category' : 'soccer',
                  'competition' : 'all',
                  'fileName' : 'inplay_scores.xml',
                  'url' : 'http://www.goalserve.com/getfeed/5d9ac1a5a7c048809742407788fe4527/soccernew/home',
-                 'type' : 'inplay'
+                 'type' : 'inplay',
+                 'adaptive' : True,
+                 'detectsLiveMatches' : True,
+                 'changeLog' : True,
+                 'binaryCache' : True,
+                 'index' : True
                  },
                 {
                  'category' : 'soccer',
                  'competition' : 'premier_league',
                  'fileName' : 'inplay_commentaries.xml',
                  'url' : 'http://www.goalserve.com/getfeed/5d9ac1a5a7c048809742407788fe4527/commentaries/epl.xml',
-                 'type' : 'inplay'
+                 'type' : 'inplay',
+                 'adaptive' : True
                  }
             ]
 
@@ -0,0 +1,32 @@
+'''
+Created on 18 Oct 2026
+'''
+import pymysql.cursors
+
+
+# Handles interaction with data_source_mapping table, which maps the ids used by a data source to our own ids
+class DataSourceMappingDao:
+
+    
+    # Constructor
+    def __init__(self, db, data_source):
+        self.db = db
+        self.data_source = data_source
+        
+    
+    # Generator giving lists of up to batchSize (table, external_id, internal_id, mapping_id) for the mappings of these tables
+    # with a mapping_id greater than mappingId, in mapping_id order. Rows are streamed from the server rather than all
+    # being held in memory at once
+    def getMappingsSince(self, mappingId, tables, batchSize):
+        getMappingsSql = ("SELECT `table`, external_id, internal_id, mapping_id FROM data_source_mapping WHERE data_source = %s AND mapping_id > %s AND `table` IN ("+
+                          ", ".join(["%s"] * len(tables))+") ORDER BY mapping_id")
+        cursor = self.db.cursor(pymysql.cursors.SSCursor)
+        try:
+            cursor.execute(getMappingsSql, [self.data_source, mappingId] + list(tables))
+            while True:
+                rows = cursor.fetchmany(batchSize)
+                if (len(rows) == 0):
+                    break
+                yield [(row[0], int(row[1]), row[2], row[3]) for row in rows]
+        finally:
+            cursor.close()
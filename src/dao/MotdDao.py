@@ -3,6 +3,8 @@ Created on 6 Jan 2015
 
 @author: chris
 '''
+import pymysql
+
 
 # Handles interaction with motd table, which stores Messages Of The Day
 class MotdDao:
@@ -19,6 +21,25 @@ class MotdDao:
         cursor = self.db.cursor()
         cursor.execute(insertMotdSql, (user_id, message))
         cursor.close()
+        
+    
+    # Create Messages Of The Day for a list of (user_id, message) with a multi-row insert. If any are duplicates, the
+    # insert falls back to creating them one at a time, skipping the duplicates. Returns the number of duplicates skipped
+    def createMany(self, motds):
+        insertMotdSql = "INSERT INTO motd(user, message) VALUES (%s, %s)"
+        numDuplicates = 0
+        cursor = self.db.cursor()
+        try:
+            cursor.executemany(insertMotdSql, motds)
+        except pymysql.err.IntegrityError:
+            for motd in motds:
+                try:
+                    cursor.execute(insertMotdSql, motd)
+                except pymysql.err.IntegrityError:
+                    numDuplicates += 1
+        finally:
+            cursor.close()
+        return numDuplicates
 
             
             
\ No newline at end of file
@@ -5,4 +5,9 @@ Team_Name = etree.XPath('name')
 Team_Players = etree.XPath('squad/player')
 Team_Image = etree.XPath('image')
 Player_Image = etree.XPath('image')
-Player_Name = etree.XPath('name')
\ No newline at end of file
+Player_Name = etree.XPath('name')
+Feed_Matches = etree.XPath('//match')
+Match_LocalTeam = etree.XPath('localteam')
+Match_VisitorTeam = etree.XPath('visitorteam')
+Match_Odds = etree.XPath('.//odd')
+Match_Category = etree.XPath('ancestor::category[1]')
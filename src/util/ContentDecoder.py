@@ -0,0 +1,53 @@
+'''
+Created on 18 Oct 2026
+'''
+import zlib
+
+# Incrementally decompresses an HTTP response body according to its Content-Encoding (gzip, deflate or none)
+class ContentDecoder:
+    
+    # Constructor
+    def __init__(self, contentEncoding):
+        self.encoding = (contentEncoding or 'identity').strip().lower()
+        self.decompressor = None
+        
+        if (self.encoding == 'gzip'):
+            self.decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        elif (self.encoding == 'deflate'):
+            # deflate should be zlib wrapped, but some servers send a raw deflate stream, so we detect which from the 
+            # zlib header once its first 2 bytes have arrived (they may be split across chunks)
+            self.header = b''
+    
+    
+    # Decompress the next chunk of the response
+    def decompress(self, chunk):
+        if (self.encoding == 'deflate' and self.decompressor == None):
+            self.header += chunk
+            if (len(self.header) < 2):
+                return b''
+            chunk = self.header
+            self.decompressor = zlib.decompressobj(zlib.MAX_WBITS if isZlibHeader(chunk) else -zlib.MAX_WBITS)
+        
+        if (self.decompressor == None):
+            return chunk
+        return self.decompressor.decompress(chunk)
+    
+    
+    # Return any remaining decompressed data once the response has been read
+    def flush(self):
+        if (self.encoding == 'deflate' and self.decompressor == None):
+            # The whole body was shorter than a zlib header, so can only be raw deflate
+            self.decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+            return self.decompressor.decompress(self.header) + self.decompressor.flush()
+        
+        if (self.decompressor == None):
+            return b''
+        return self.decompressor.flush()
+
+
+#
+# isZlibHeader: Returns True if data starts with a zlib header: compression method 8 (deflate) with a window of at most 
+#               32K, and a check value making the first 2 bytes a multiple of 31
+#
+def isZlibHeader(data):
+    return ((data[0] & 0x0F) == 8 and (data[0] >> 4) <= 7 and ((data[0] << 8) | data[1]) % 31 == 0)
@@ -0,0 +1,40 @@
+'''
+Created on 18 Oct 2026
+
+Streaming parse of an XML file that only parses the <tag> elements that are wanted. The byte range of each element and
+its key (e.g. a player's id, from its start tag) are found with a scan of the raw bytes (see XmlOffsetIndex), and only
+the elements whose key is wanted are parsed, so the content of unwanted elements (e.g. the large base64 <image> of a
+player we have no mapping for) is never parsed or turned into Python objects at all.
+'''
+import mmap
+
+from lxml import etree    # xml parsing
+
+# Import local modules
+import util.XmlOffsetIndex as XmlOffsetIndex
+
+
+#
+# filterElements: Parses the <tag> elements of an XML file whose key (the first match of keyPattern, a bytes regex with one
+#                 group, in the element's start tag) is wanted, applying func to each. Keys are checked windowSize elements at a time:
+#                 prefetch(keys) is called for each window before isWanted(key) is checked for each of its elements. 
+#                 Returns a summary of the number of elements wanted and skipped
+#
+def filterElements(fileName, tag, keyPattern, isWanted, func, windowSize, prefetch):
+    (encoding, elements) = XmlOffsetIndex.scanElements(fileName, tag, keyPattern, True)
+    parser = etree.XMLParser(encoding=encoding)
+    summary = {'wanted' : 0, 'skipped' : 0}
+
+    with open(fileName, 'rb') as xmlFile, mmap.mmap(xmlFile.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+        for i in range(0, len(elements), windowSize):
+            window = [(start, end, (keys[0] if len(keys) > 0 else None)) for (start, end, keys) in elements[i:i + windowSize]]
+            prefetch([key for (start, end, key) in window if key != None])
+
+            for (start, end, key) in window:
+                if (key != None and isWanted(key)):
+                    summary['wanted'] += 1
+                    func(etree.fromstring(buffer[start:end], parser))
+                else:
+                    summary['skipped'] += 1
+
+    return summary
@@ -0,0 +1,107 @@
+'''
+Created on 18 Oct 2026
+
+Append-only archive of the snapshots of a feed, so matches can be replayed and odds audited.
+
+Snapshots are stored in a folder next to the feed file (<fileName>.archive), in one segment file per UTC day (YYYYMMDD.seg).
+Each snapshot is appended to the segment as its own gzip member. Alongside each segment is an index file (YYYYMMDD.idx) of
+fixed size (time, offset, length) records in time order, so the snapshot at a given time can be found with a binary search
+of the index and a single seek into the segment.
+'''
+import os
+import struct
+import time
+import zlib
+
+# Import local modules
+import config.Settings
+
+INDEX_RECORD = struct.Struct('<dQI')
+
+
+#
+# getArchiveFolder: Returns the folder that a feed file's snapshots are archived to
+#
+def getArchiveFolder(fileName):
+    return fileName+'.archive'
+
+
+#
+# getSegmentName: Returns the name of the segment (YYYYMMDD) that a snapshot taken at snapshotTime is stored in
+#
+def getSegmentName(snapshotTime):
+    return time.strftime('%Y%m%d', time.gmtime(snapshotTime))
+
+
+#
+# archiveSnapshot: Compresses the feed file currently on disk and appends it to the archive
+#
+def archiveSnapshot(fileName, snapshotTime=None):
+    snapshotTime = (time.time() if snapshotTime == None else snapshotTime)
+    archiveFolder = getArchiveFolder(fileName)
+    os.makedirs(archiveFolder, exist_ok=True)
+    segmentFileName = archiveFolder+'/'+getSegmentName(snapshotTime)
+
+    compressor = zlib.compressobj(config.Settings.DATA_FEED_ARCHIVE_COMPRESSION_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    with open(fileName, 'rb') as inFile, open(segmentFileName+'.seg', 'ab') as segmentFile:
+        offset = segmentFile.tell()
+        for chunk in iter(lambda: inFile.read(config.Settings.DATA_FEED_CHUNK_SIZE), b''):
+            segmentFile.write(compressor.compress(chunk))
+        segmentFile.write(compressor.flush())
+        length = segmentFile.tell() - offset
+
+    # The index is only written once the snapshot is safely in the segment, so it never points at partial data
+    with open(segmentFileName+'.idx', 'ab') as indexFile:
+        indexFile.write(INDEX_RECORD.pack(snapshotTime, offset, length))
+
+    return length
+
+
+#
+# findSnapshot: Returns the (time, offset, length) index record of the latest snapshot in a segment taken at or before
+#               snapshotTime, or None if there is none
+#
+def findSnapshot(indexFileName, snapshotTime):
+    with open(indexFileName, 'rb') as indexFile:
+        numRecords = os.fstat(indexFile.fileno()).st_size // INDEX_RECORD.size
+        low = 0
+        high = numRecords
+
+        # Binary search for the first record after snapshotTime
+        while (low < high):
+            middle = (low + high) // 2
+            indexFile.seek(middle * INDEX_RECORD.size)
+            if (INDEX_RECORD.unpack(indexFile.read(INDEX_RECORD.size))[0] <= snapshotTime):
+                low = middle + 1
+            else:
+                high = middle
+
+        if (low == 0):
+            return None
+
+        indexFile.seek((low - 1) * INDEX_RECORD.size)
+        return INDEX_RECORD.unpack(indexFile.read(INDEX_RECORD.size))
+
+
+#
+# getSnapshotAt: Returns a tuple of (time, contents) of the snapshot of a feed file that was current at snapshotTime,
+#                or None if the archive has no snapshot that old
+#
+def getSnapshotAt(fileName, snapshotTime):
+    archiveFolder = getArchiveFolder(fileName)
+    if (not os.path.isdir(archiveFolder)):
+        return None
+
+    # Start with the segment for that day, falling back to earlier segments if the day has no snapshot before snapshotTime
+    segmentName = getSegmentName(snapshotTime)
+    segmentNames = sorted(name[:-4] for name in os.listdir(archiveFolder) if name.endswith('.idx') and name[:-4] <= segmentName)
+
+    for name in reversed(segmentNames):
+        record = findSnapshot(archiveFolder+'/'+name+'.idx', snapshotTime)
+        if (record != None):
+            (recordTime, offset, length) = record
+            with open(archiveFolder+'/'+name+'.seg', 'rb') as segmentFile:
+                segmentFile.seek(offset)
+                return (recordTime, zlib.decompress(segmentFile.read(length), 16 + zlib.MAX_WBITS))
+
+    return None
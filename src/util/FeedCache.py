@@ -0,0 +1,168 @@
+'''
+Created on 18 Oct 2026
+
+Compact binary copy of the matches in a feed, written next to the feed's XML file (as <fileName>.bin) so that readers
+can memory-map it and look matches up without parsing XML.
+
+File layout (all integers little-endian):
+    header     magic 'IPFC', format version, md5 digest of the XML it was built from, mtime (ns) of that XML file,
+               number of matches, number of odds, offset and length of the string table
+    matches    one fixed size record per match, sorted by match id:
+               id, status and score (each a string table offset and length), index of first odd, number of odds
+    odds       one fixed size record per odd: key and value (each a string table offset and length)
+    strings    utf-8 string table. Strings that repeat (e.g. odds keys) are only stored once
+'''
+import mmap
+import os
+import struct
+
+MAGIC = b'IPFC'
+FORMAT_VERSION = 1
+
+HEADER = struct.Struct('<4sH16sqIIII')
+MATCH_RECORD = struct.Struct('<IHIHIHII')
+ODD_RECORD = struct.Struct('<IHIH')
+
+# Offset used for strings that are None
+NULL_STRING = 0xFFFFFFFF
+
+
+#
+# getFeedCacheFileName: Returns the name of the binary cache written alongside a feed file
+#
+def getFeedCacheFileName(fileName):
+    return fileName+'.bin'
+
+
+#
+# writeFeedCache: Writes the binary cache for a feed file from its parsed matches (as returned by FeedParser.parseMatches).
+#                 As with the XML, it is written to a temp file then renamed so readers never see a partial file
+#
+def writeFeedCache(fileName, matches, xmlDigest):
+    strings = bytearray()
+    stringOffsets = {}
+
+    # Adds a string to the string table (once) and returns its (offset, length)
+    def addString(value):
+        if (value == None):
+            return (NULL_STRING, 0)
+        if (value not in stringOffsets):
+            encoded = value.encode('utf-8')
+            stringOffsets[value] = (len(strings), len(encoded))
+            strings.extend(encoded)
+        return stringOffsets[value]
+
+    matchRecords = bytearray()
+    oddRecords = bytearray()
+    numOdds = 0
+
+    for matchId in sorted(matches, key=lambda matchId: matchId.encode('utf-8')):
+        match = matches[matchId]
+        matchRecords.extend(MATCH_RECORD.pack(*(addString(matchId) + addString(match['status']) + addString(match['score']) +
+                                                (numOdds, len(match['odds'])))))
+        for key, value in match['odds'].items():
+            oddRecords.extend(ODD_RECORD.pack(*(addString(key) + addString(value))))
+        numOdds += len(match['odds'])
+
+    stringsOffset = HEADER.size + len(matchRecords) + len(oddRecords)
+    header = HEADER.pack(MAGIC, FORMAT_VERSION, bytes.fromhex(xmlDigest), os.stat(fileName).st_mtime_ns,
+                         len(matches), numOdds, stringsOffset, len(strings))
+
+    cacheFileName = getFeedCacheFileName(fileName)
+    tempFile = cacheFileName+'.tmp'
+    with open(tempFile, 'wb') as outFile:
+        outFile.write(header)
+        outFile.write(matchRecords)
+        outFile.write(oddRecords)
+        outFile.write(strings)
+    os.rename(tempFile, cacheFileName)
+
+
+# Reads a feed's binary cache through a memory map. Lookups decode only the records they need
+class FeedCacheReader:
+
+
+    # Constructor
+    def __init__(self, fileName):
+        self.xmlFileName = fileName
+        with open(getFeedCacheFileName(fileName), 'rb') as cacheFile:
+            self.buffer = mmap.mmap(cacheFile.fileno(), 0, access=mmap.ACCESS_READ)
+
+        (magic, version, xmlDigest, self.xmlMtime, self.numMatches, self.numOdds,
+         self.stringsOffset, stringsLength) = HEADER.unpack_from(self.buffer, 0)
+        if (magic != MAGIC or version != FORMAT_VERSION):
+            self.buffer.close()
+            raise ValueError("Unsupported feed cache file for "+fileName+": magic="+str(magic)+", version="+str(version))
+
+        self.xmlDigest = xmlDigest.hex()
+        self.matchesOffset = HEADER.size
+        self.oddsOffset = self.matchesOffset + self.numMatches * MATCH_RECORD.size
+
+
+    # Returns True if the cache was built from the XML file currently on disk
+    def isCurrent(self):
+        return os.stat(self.xmlFileName).st_mtime_ns == self.xmlMtime
+
+
+    # Returns the ids of all matches in the feed
+    def getMatchIds(self):
+        return [self._getString(*MATCH_RECORD.unpack_from(self.buffer, self.matchesOffset + i * MATCH_RECORD.size)[0:2])
+                for i in range(self.numMatches)]
+
+
+    # Returns {status, score, odds} for a match, or None if the match is not in the feed
+    def getMatch(self, matchId):
+        key = matchId.encode('utf-8')
+        low = 0
+        high = self.numMatches
+
+        # Binary search the sorted match records
+        while (low < high):
+            middle = (low + high) // 2
+            record = MATCH_RECORD.unpack_from(self.buffer, self.matchesOffset + middle * MATCH_RECORD.size)
+            middleKey = self._getBytes(record[0], record[1])
+            if (middleKey < key):
+                low = middle + 1
+            elif (middleKey > key):
+                high = middle
+            else:
+                return self._getMatch(record)
+
+        return None
+
+
+    # Close the memory map
+    def close(self):
+        self.buffer.close()
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, excType, excValue, traceback):
+        self.close()
+
+
+    # Decodes a match record
+    def _getMatch(self, record):
+        (idOffset, idLength, statusOffset, statusLength, scoreOffset, scoreLength, firstOdd, numOdds) = record
+        odds = {}
+        for i in range(firstOdd, firstOdd + numOdds):
+            (keyOffset, keyLength, valueOffset, valueLength) = ODD_RECORD.unpack_from(self.buffer, self.oddsOffset + i * ODD_RECORD.size)
+            odds[self._getString(keyOffset, keyLength)] = self._getString(valueOffset, valueLength)
+
+        return {'status' : self._getString(statusOffset, statusLength),
+                'score' : self._getString(scoreOffset, scoreLength),
+                'odds' : odds}
+
+
+    def _getBytes(self, offset, length):
+        start = self.stringsOffset + offset
+        return self.buffer[start:start + length]
+
+
+    def _getString(self, offset, length):
+        if (offset == NULL_STRING):
+            return None
+        return self._getBytes(offset, length).decode('utf-8')
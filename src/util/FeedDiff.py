@@ -0,0 +1,75 @@
+'''
+Created on 18 Oct 2026
+
+Compares successive snapshots of a feed and writes a change log containing only the matches that changed
+'''
+import json
+import os
+import time
+
+# Import local modules
+import config.Settings
+
+
+#
+# diffMatches: Compares two snapshots of a feed (as returned by FeedParser.parseMatches) and returns a list of changes,
+#              one per match that was added, removed, or whose status, score or odds changed. Only the fields that
+#              changed are included, and for odds only the odds that changed (with removed odds given as None)
+#
+def diffMatches(previousMatches, currentMatches):
+    changes = []
+
+    for matchId, current in currentMatches.items():
+        previous = previousMatches.get(matchId)
+        if (previous == None):
+            changes.append({'match' : matchId, 'added' : True, 'status' : current['status'], 'score' : current['score'], 'odds' : current['odds']})
+            continue
+
+        change = {}
+        if (current['status'] != previous['status']):
+            change['status'] = current['status']
+        if (current['score'] != previous['score']):
+            change['score'] = current['score']
+
+        oddsChanges = {key : value for key, value in current['odds'].items() if previous['odds'].get(key) != value}
+        for key in previous['odds']:
+            if (key not in current['odds']):
+                oddsChanges[key] = None
+        if (len(oddsChanges) > 0):
+            change['odds'] = oddsChanges
+
+        if (len(change) > 0):
+            change['match'] = matchId
+            changes.append(change)
+
+    for matchId in previousMatches:
+        if (matchId not in currentMatches):
+            changes.append({'match' : matchId, 'removed' : True})
+
+    return changes
+
+
+#
+# getChangeLogFileName: Returns the name of the change log written alongside a feed file
+#
+def getChangeLogFileName(fileName):
+    return fileName+'.changes.jsonl'
+
+
+#
+# writeChangeLog: Appends changes to a feed's change log as JSON lines, each stamped with the time of the snapshot.
+#                 The log is rotated to a .1 file once it reaches DATA_FEED_CHANGE_LOG_MAX_BYTES
+#
+def writeChangeLog(fileName, changes, snapshotTime=None):
+    if (len(changes) == 0):
+        return
+
+    changeLogFileName = getChangeLogFileName(fileName)
+    if (os.path.exists(changeLogFileName) and os.path.getsize(changeLogFileName) >= config.Settings.DATA_FEED_CHANGE_LOG_MAX_BYTES):
+        os.replace(changeLogFileName, changeLogFileName+'.1')
+
+    snapshotTime = (time.time() if snapshotTime == None else snapshotTime)
+    with open(changeLogFileName, 'a') as changeLog:
+        for change in changes:
+            change['time'] = snapshotTime
+            changeLog.write(json.dumps(change, separators=(',', ':'))+'\n')
@@ -0,0 +1,137 @@
+'''
+Created on 18 Oct 2026
+
+Functions for extracting match data from goalserve XML feeds
+'''
+from datetime import datetime, timedelta, timezone
+from lxml import etree    # xml parsing
+import re
+
+# Import local modules
+import config.Settings
+import metadata.XPath
+
+# Match statuses given by goalserve while a match is being played (otherwise the status is the minute, e.g. 45 or 90+2)
+LIVE_MATCH_STATUSES = {'HT', 'ET', 'Break Time', 'Pen.'}
+MATCH_MINUTE_STATUS = re.compile(r"^\d+(\+\d+)?$")
+
+# Status of a match that has not yet kicked off is its kick-off time
+KICKOFF_TIME_STATUS = re.compile(r"^\d{1,2}:\d{2}$")
+
+
+#
+# isMatchLive: Returns True if the match status shows it is being played
+#
+def isMatchLive(status):
+    return status in LIVE_MATCH_STATUSES or MATCH_MINUTE_STATUS.match(status) != None
+
+
+#
+# getKickoffTime: Returns the kick-off time of a match that has not started as a UTC timestamp, or None if the match has
+#                 started, finished or its kick-off time is not known
+#
+def getKickoffTime(match):
+    status = match.get('status', '')
+    formattedDate = match.get('formatted_date')
+    if (KICKOFF_TIME_STATUS.match(status) == None or formattedDate == None):
+        return None
+
+    try:
+        kickoff = datetime.strptime(formattedDate+' '+status, '%d.%m.%Y %H:%M')
+    except ValueError:
+        return None
+
+    feedTimezone = timezone(timedelta(hours=config.Settings.GOALSERVE_UTC_OFFSET_HOURS))
+    return kickoff.replace(tzinfo=feedTimezone).timestamp()
+
+
+#
+# getMatchActivity: Parses a scores feed and returns a tuple of (number of matches in progress, sorted list of the kick-off
+#                   times of matches that have not started, as UTC timestamps)
+#
+def getMatchActivity(fileName):
+    liveMatches = 0
+    kickoffTimes = []
+
+    for match in metadata.XPath.Feed_Matches(etree.parse(fileName)):
+        if (isMatchLive(match.get('status', ''))):
+            liveMatches += 1
+        else:
+            kickoff = getKickoffTime(match)
+            if (kickoff != None):
+                kickoffTimes.append(kickoff)
+
+    return (liveMatches, sorted(kickoffTimes))
+
+
+#
+# getMatchId: Returns the goalserve id of a match element
+#
+def getMatchId(match):
+    return match.get('id') or match.get('static_id')
+
+
+#
+# getMatchScore: Returns the score of a match as 'home-away', or None if the feed does not give one
+#
+def getMatchScore(match):
+    localTeam = metadata.XPath.Match_LocalTeam(match)
+    visitorTeam = metadata.XPath.Match_VisitorTeam(match)
+    if (len(localTeam) == 0 or len(visitorTeam) == 0 or localTeam[0].get('goals') == None):
+        return None
+    return localTeam[0].get('goals')+'-'+visitorTeam[0].get('goals', '')
+
+
+#
+# getMatchOdds: Returns a dictionary of every odd given for a match. Each odd is keyed by the names of the elements it is
+#               nested in (e.g. market and bookmaker) followed by its own name, e.g. 'Match Winner/bet365/Home'
+#
+def getMatchOdds(match):
+    odds = {}
+    for odd in metadata.XPath.Match_Odds(match):
+        keyParts = [odd.get('name', '')]
+        parent = odd.getparent()
+        while (parent != None and parent is not match):
+            name = parent.get('name') or parent.get('value') or parent.get('id')
+            if (name != None):
+                keyParts.insert(0, name)
+            parent = parent.getparent()
+        odds['/'.join(keyParts)] = odd.get('value')
+    return odds
+
+
+#
+# getMatchTeamNames: Returns a tuple of the (home, away) team names of a match
+#
+def getMatchTeamNames(match):
+    localTeam = metadata.XPath.Match_LocalTeam(match)
+    visitorTeam = metadata.XPath.Match_VisitorTeam(match)
+    return (localTeam[0].get('name') if len(localTeam) > 0 else None,
+            visitorTeam[0].get('name') if len(visitorTeam) > 0 else None)
+
+
+#
+# getMatchCompetition: Returns the name of the competition (goalserve category) a match is in
+#
+def getMatchCompetition(match):
+    category = metadata.XPath.Match_Category(match)
+    return (category[0].get('name') if len(category) > 0 else None)
+
+
+#
+# parseMatches: Parses a feed and returns a dictionary of match_id -> {status, score, odds, home, away, competition}
+#               for every match in it
+#
+def parseMatches(fileName):
+    matches = {}
+    for match in metadata.XPath.Feed_Matches(etree.parse(fileName)):
+        matchId = getMatchId(match)
+        if (matchId != None):
+            (home, away) = getMatchTeamNames(match)
+            matches[matchId] = {'status' : match.get('status'),
+                                'score' : getMatchScore(match),
+                                'odds' : getMatchOdds(match),
+                                'home' : home,
+                                'away' : away,
+                                'competition' : getMatchCompetition(match)}
+    return matches
@@ -0,0 +1,188 @@
+'''
+Created on 18 Oct 2026
+'''
+import http.client
+import logging
+import threading
+import time
+import urllib.parse
+
+logger = logging.getLogger(__name__)
+
+# Errors raised when a keep-alive connection has been closed by the server while sitting idle in the pool
+STALE_CONNECTION_ERRORS = (http.client.RemoteDisconnected, http.client.BadStatusLine, BrokenPipeError, ConnectionResetError)
+
+# Redirect statuses that are followed, and the most redirects followed for one request
+REDIRECT_STATUSES = (301, 302, 303, 307, 308)
+MAX_REDIRECTS = 5
+
+
+# Pool of persistent (keep-alive) HTTP connections, shared by every request made to the same host
+class HttpConnectionPool:
+
+
+    # Constructor
+    def __init__(self, poolSize, connectTimeout, readTimeout):
+        self.poolSize = poolSize
+        self.connectTimeout = connectTimeout
+        self.readTimeout = readTimeout
+        self.lock = threading.Lock()
+
+        # (scheme, host, port) -> list of idle connections to that host
+        self.idleConnections = {}
+
+        # (scheme, host, port) -> semaphore limiting the number of connections open to that host at once
+        self.hostSemaphores = {}
+
+
+    # Make a GET request, following any redirects (on a connection to the host redirected to). Returns a PooledResponse 
+    # which must be closed to return its connection to the pool
+    def get(self, url, headers={}):
+        for redirects in range(MAX_REDIRECTS + 1):
+            response = self._get(url, headers)
+            if (response.status not in REDIRECT_STATUSES):
+                return response
+            
+            location = response.getheader('Location')
+            response.read()
+            response.close()
+            if (location == None):
+                raise http.client.HTTPException("HTTP status "+str(response.status)+" with no Location loading "+url)
+            
+            redirectUrl = urllib.parse.urljoin(url, location)
+            logger.info("Following redirect (status="+str(response.status)+") from "+url+" to "+redirectUrl)
+            url = redirectUrl
+        
+        raise http.client.HTTPException("Too many redirects (more than "+str(MAX_REDIRECTS)+") loading "+url)
+
+
+    # Make a single GET request, returning a PooledResponse
+    def _get(self, url, headers):
+        parsedUrl = urllib.parse.urlsplit(url)
+        hostKey = (parsedUrl.scheme, parsedUrl.hostname, parsedUrl.port)
+        path = parsedUrl.path + ('?'+parsedUrl.query if parsedUrl.query else '')
+
+        with self.lock:
+            semaphore = self.hostSemaphores.setdefault(hostKey, threading.BoundedSemaphore(self.poolSize))
+        semaphore.acquire()
+
+        try:
+            connection = self._getIdleConnection(hostKey)
+            if (connection != None):
+                try:
+                    return self._request(hostKey, connection, path, headers, 0)
+                except STALE_CONNECTION_ERRORS:
+                    # The server closed the idle connection, so retry once on a new one
+                    connection.close()
+                    logger.debug("Discarding stale connection to "+str(parsedUrl.hostname))
+
+            connectStart = time.time()
+            connection = self._newConnection(hostKey)
+            connection.connect()
+            connection.sock.settimeout(self.readTimeout)
+            return self._request(hostKey, connection, path, headers, time.time() - connectStart)
+
+        except:
+            semaphore.release()
+            raise
+
+
+    # Close all idle connections
+    def close(self):
+        with self.lock:
+            for connections in self.idleConnections.values():
+                for connection in connections:
+                    connection.close()
+            self.idleConnections = {}
+
+
+    # Send the request on the given connection and wait for the response headers, logging connect and first-byte latency
+    def _request(self, hostKey, connection, path, headers, connectTime):
+        requestStart = time.time()
+        try:
+            connection.request('GET', path, headers=headers)
+            response = connection.getresponse()
+        except:
+            connection.close()
+            raise
+        firstByteTime = time.time() - requestStart
+
+        logger.info("GET "+hostKey[1]+path+": status="+str(response.status)+
+                    (", connect="+"{:.1f}".format(connectTime * 1000)+"ms" if connectTime > 0 else ", reused connection")+
+                    ", firstByte="+"{:.1f}".format(firstByteTime * 1000)+"ms")
+        return PooledResponse(self, hostKey, connection, response)
+
+
+    # Returns an idle connection to the host, or None if there are none
+    def _getIdleConnection(self, hostKey):
+        with self.lock:
+            connections = self.idleConnections.get(hostKey)
+            if (connections):
+                return connections.pop()
+        return None
+
+
+    # Creates a new (not yet connected) connection to the host
+    def _newConnection(self, hostKey):
+        (scheme, host, port) = hostKey
+        if (scheme == 'https'):
+            return http.client.HTTPSConnection(host, port, timeout=self.connectTimeout)
+        return http.client.HTTPConnection(host, port, timeout=self.connectTimeout)
+
+
+    # Return a connection to the pool once its response has been finished with
+    def _release(self, hostKey, connection, reusable):
+        if (reusable):
+            with self.lock:
+                self.idleConnections.setdefault(hostKey, []).append(connection)
+        else:
+            connection.close()
+        self.hostSemaphores[hostKey].release()
+
+
+
+# Response from a pooled connection. Closing it (or leaving a with block) returns the connection to the pool
+class PooledResponse:
+
+
+    # Constructor
+    def __init__(self, pool, hostKey, connection, response):
+        self.pool = pool
+        self.hostKey = hostKey
+        self.connection = connection
+        self.response = response
+        self.status = response.status
+        self.released = False
+
+
+    # Read up to amt bytes of the response body (all of it if amt is None)
+    def read(self, amt=None):
+        return self.response.read(amt)
+
+
+    # Returns the value of a response header, or default if it is not present
+    def getheader(self, name, default=None):
+        return self.response.getheader(name, default)
+
+
+    # Return the connection to the pool. It is only kept if the whole body was read and the server allows keep-alive
+    def close(self):
+        if (self.released):
+            return
+        self.released = True
+        
+        # Responses with no body (e.g. 304 Not Modified) need a read to mark them as finished
+        if (not self.response.isclosed() and self.response.length == 0):
+            self.response.read()
+        
+        reusable = self.response.isclosed() and not self.response.will_close
+        self.response.close()
+        self.pool._release(self.hostKey, self.connection, reusable)
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, excType, excValue, traceback):
+        self.close()
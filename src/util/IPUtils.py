@@ -6,11 +6,13 @@ Created on 23 Nov 2014
 from base64 import decodebytes
 from boto.s3.key import Key
 from io import BytesIO
+import hashlib
 import imghdr
 import logging
 from logging.handlers import TimedRotatingFileHandler
 import os
 import pwd
+import zipfile
 
 # Import local modules
 import config.Settings
@@ -25,6 +27,55 @@ def fast_iter(context, func):
         while elem.getprevious() is not None:
             del elem.getparent()[0]
     del context
+
+
+#
+# fast_iter_window: Like fast_iter, but collects the elements into windows of windowSize and calls prefetch(window) before
+#                   applying func to each element of the window, so data needed for the elements (e.g. their ID mappings) 
+#                   can be looked up for the whole window at once
+#
+def fast_iter_window(context, func, windowSize, prefetch):
+    window = []
+    for event, elem in context:
+        window.append(elem)
+        if (len(window) >= windowSize):
+            processWindow(window, func, prefetch)
+            window = []
+    if (len(window) > 0):
+        processWindow(window, func, prefetch)
+    del context
+
+
+#
+# processWindow: Applies func to each element of a window (after prefetch) and frees the parsed elements
+#
+def processWindow(window, func, prefetch):
+    prefetch(window)
+    for elem in window:
+        func(elem)
+        elem.clear()
+    for elem in window:
+        while elem.getprevious() is not None:
+            del elem.getparent()[0]
+    
+    
+#
+# openXmlFiles: Generator giving (name, file object) for each XML file to process in fileName. If fileName is a zip archive
+#               (e.g. goalserve's teams.zip/players.zip), each .xml member is streamed straight from the archive without
+#               unzipping it to disk. memberNames optionally restricts which members (by base name) are given
+#
+def openXmlFiles(fileName, memberNames=None):
+    if (zipfile.is_zipfile(fileName)):
+        with zipfile.ZipFile(fileName) as archive:
+            for member in archive.infolist():
+                baseName = os.path.basename(member.filename)
+                if (not baseName.endswith('.xml') or (memberNames != None and baseName not in memberNames)):
+                    continue
+                with archive.open(member) as xmlFile:
+                    yield (fileName+':'+member.filename, xmlFile)
+    else:
+        with open(fileName, 'rb') as xmlFile:
+            yield (fileName, xmlFile)
     
     
 #
@@ -119,6 +170,13 @@ def getLogger(scriptName, loggingLevel):
     return logger
 
 
+#
+# getUserPath: Replaces {UserName} in a configured path with the name of the user running the process
+#
+def getUserPath(path):
+    return path.replace("{UserName}", pwd.getpwuid(os.getuid()).pw_name)
+
+
 #
 # getDataFeedFilePath: Returns the directory that a data feed will be downloaded to
 #
@@ -128,6 +186,24 @@ def getDataFeedFilePath(feed):
     return baseFolder +'/' +feed['category']+'/'+feed['competition']
 
 
+#
+# getDataFeedFileName: Returns the full path of the file that a data feed will be downloaded to
+#
+def getDataFeedFileName(feed):
+    return getDataFeedFilePath(feed) +'/' +feed['fileName']
+
+
+#
+# getFileDigest: Returns the hex md5 digest of a file's contents, reading it in chunks so large files are not held in memory
+#
+def getFileDigest(fileName, chunkSize=65536):
+    digest = hashlib.md5()
+    with open(fileName, 'rb') as fh:
+        for chunk in iter(lambda: fh.read(chunkSize), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
 #
 # dictToString: Converts a dictionary to a comma separated string
 #
@@ -138,10 +214,10 @@ def dictToString(dict):
     firstItem = True
     for k, v in dict.items():
         if (firstItem):
-            dictString = k+'='+v
+            dictString = k+'='+str(v)
             firstItem = False
         else:
-            dictString = dictString+', '+k+'='+v
+            dictString = dictString+', '+k+'='+str(v)
             
     return dictString
             
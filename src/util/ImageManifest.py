@@ -0,0 +1,102 @@
+'''
+Created on 18 Oct 2026
+'''
+from boto.s3.connection import S3Connection
+import fcntl
+import json
+import logging
+import os
+import threading
+
+# Import local modules
+import config.Connections
+import config.Settings
+
+logger = logging.getLogger(__name__)
+
+
+# Local record of the md5 digest of every image saved, keyed by where it was saved (S3 key or file name), so images that
+# have not changed since the last import can be skipped. md5 is used so digests can be compared with S3 ETags. 
+# The manifest is shared by all imports, so only the changes made by this import are written back to it (see save())
+class ImageManifest:
+
+
+    # Constructor
+    def __init__(self, manifestFileName):
+        self.manifestFileName = manifestFileName
+        self.lock = threading.Lock()
+        self.digests = {}
+
+        # Changes made by this import: fileName -> new digest, and the fileNames that have been dropped
+        self.updated = {}
+        self.removed = set()
+
+        if (os.path.exists(manifestFileName)):
+            with open(manifestFileName) as manifestFile:
+                self.digests = json.load(manifestFile)
+        logger.info("Loaded image manifest with "+str(len(self.digests))+" images from "+manifestFileName)
+
+
+    # Returns True if the image saved as fileName already has this digest. Local files must also still exist
+    def isUnchanged(self, fileName, digest, isLocalFile):
+        with self.lock:
+            if (self.digests.get(fileName) != digest):
+                return False
+        return (not isLocalFile or os.path.exists(fileName))
+
+
+    # Record the digest of an image that has been saved
+    def update(self, fileName, digest):
+        with self.lock:
+            self.digests[fileName] = digest
+            self.updated[fileName] = digest
+            self.removed.discard(fileName)
+
+
+    # Replace the digests of all images under an S3 prefix with the ETags of what is actually in S3. Images missing
+    # from S3 are dropped, so they will be uploaded again
+    def reconcileWithS3(self, prefix):
+        s3conn = S3Connection(config.Connections.AWS_ACCESS_KEY_ID, config.Connections.AWS_SECRET_ACCESS_KEY)
+        try:
+            s3bucket = s3conn.get_bucket(config.Settings.S3_BUCKET, validate=False)
+            s3Digests = {}
+            for key in s3bucket.list(prefix=prefix):
+                # Multipart uploads have an ETag that is not an md5 digest (it contains a '-'), so cannot be compared
+                etag = key.etag.strip('"')
+                if ('-' not in etag):
+                    s3Digests[key.name] = etag
+        finally:
+            s3conn.close()
+
+        with self.lock:
+            for fileName in [fileName for fileName in self.digests if fileName.startswith(prefix)]:
+                del self.digests[fileName]
+                self.updated.pop(fileName, None)
+                self.removed.add(fileName)
+            self.digests.update(s3Digests)
+            self.updated.update(s3Digests)
+            self.removed.difference_update(s3Digests)
+        logger.info("Reconciled image manifest with "+str(len(s3Digests))+" images in S3 under "+prefix)
+
+
+    # Write this import's changes to the manifest on disk. Another import may have saved the manifest since it was loaded,
+    # so the changes are merged into the copy on disk, holding a file lock so imports save one at a time. Written via a
+    # temp file and rename, so a failed write never loses the previous manifest
+    def save(self):
+        os.makedirs(os.path.dirname(self.manifestFileName), exist_ok=True)
+        tempFile = self.manifestFileName+'.tmp'
+        with open(self.manifestFileName+'.lock', 'w') as lockFile, self.lock:
+            fcntl.flock(lockFile, fcntl.LOCK_EX)
+            
+            digests = {}
+            if (os.path.exists(self.manifestFileName)):
+                with open(self.manifestFileName) as manifestFile:
+                    digests = json.load(manifestFile)
+            for fileName in self.removed:
+                digests.pop(fileName, None)
+            digests.update(self.updated)
+            
+            with open(tempFile, 'w') as manifestFile:
+                json.dump(digests, manifestFile)
+            os.rename(tempFile, self.manifestFileName)
+            self.digests = digests
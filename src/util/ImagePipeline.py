@@ -0,0 +1,122 @@
+'''
+Created on 18 Oct 2026
+'''
+from base64 import decodebytes
+from boto.s3.connection import S3Connection
+import hashlib
+import imghdr
+import logging
+import queue
+import threading
+import traceback
+
+# Import local modules
+import config.Connections
+import config.Settings
+import util.IPUtils as IPUtils
+
+logger = logging.getLogger(__name__)
+
+
+# Decodes, validates and stores base64 encoded images on a pool of worker threads, so that parsing does not wait on
+# each image being saved. Jobs are queued with submit(), which blocks while the queue is full to cap memory use.
+# If given an ImageManifest, images whose content has not changed since they were last saved are skipped
+class ImagePipeline:
+
+
+    # Constructor
+    def __init__(self, numWorkers, queueSize, storeToS3, manifest=None):
+        self.storeToS3 = storeToS3
+        self.manifest = manifest
+        self.jobs = queue.Queue(maxsize=queueSize)
+        self.lock = threading.Lock()
+        self.summary = {'saved' : 0, 'unchanged' : 0, 'invalid' : 0, 'failed' : 0}
+
+        self.workers = [threading.Thread(target=self._work, name='ImageWorker-'+str(i), daemon=True) for i in range(max(1, numWorkers))]
+        for worker in self.workers:
+            worker.start()
+
+
+    # Queue an image to be saved as fileName (an S3 key if storing to Amazon S3). The image is either base64 encoded, or 
+    # bytes that have already been decoded
+    def submit(self, image, fileName):
+        self.jobs.put((image, fileName))
+
+
+    # Wait for all queued images to be saved, stop the workers, save the manifest and return the summary of
+    # saved/unchanged/invalid/failed images
+    def close(self):
+        for worker in self.workers:
+            self.jobs.put(None)
+        for worker in self.workers:
+            worker.join()
+        if (self.manifest != None):
+            self.manifest.save()
+        return self.summary
+
+
+    # Count the outcome of a job
+    def _count(self, outcome):
+        with self.lock:
+            self.summary[outcome] += 1
+
+
+    # Worker thread: saves queued images until told to stop. Each worker has its own S3 connection as they are not thread safe
+    def _work(self):
+        s3conn = None
+        s3bucket = None
+        connected = True
+
+        if (self.storeToS3):
+            try:
+                s3conn = S3Connection(config.Connections.AWS_ACCESS_KEY_ID, config.Connections.AWS_SECRET_ACCESS_KEY)
+                s3bucket = s3conn.get_bucket(config.Settings.S3_BUCKET, validate=False) # No need to validate as we know this bucket exists
+            except Exception:
+                logger.error("Failed to connect to Amazon S3, images given to this worker will not be saved: "+traceback.format_exc())
+                connected = False
+
+        # Keep taking jobs even if we could not connect, so the queue never stops draining
+        while True:
+            job = self.jobs.get()
+            if (job == None):
+                break
+            if (connected):
+                self._saveImage(job[0], job[1], s3bucket)
+            else:
+                self._count('failed')
+
+        if (s3conn != None):
+            s3conn.close()
+
+
+    # Decode and validate an image, and save it if it is valid
+    def _saveImage(self, image, fileName, s3bucket):
+        try:
+            byteString = (image if isinstance(image, bytes) else decodebytes(str(image).encode('ascii')))
+            fileType = imghdr.what(None, byteString)
+
+            # Only save if this is a valid image
+            if (fileType == None):
+                logger.warning("Invalid image found in tag, unable to save "+fileName)
+                self._count('invalid')
+                return
+
+            digest = hashlib.md5(byteString).hexdigest()
+            if (self.manifest != None and self.manifest.isUnchanged(fileName, digest, s3bucket == None)):
+                logger.debug("Image unchanged since last import, not saving "+fileName)
+                self._count('unchanged')
+                return
+
+            if (s3bucket != None):
+                IPUtils.saveByteStringToAmazonS3(byteString, fileName, s3bucket)
+            else:
+                IPUtils.saveByteStringToFile(byteString, fileName)
+
+            if (self.manifest != None):
+                self.manifest.update(fileName, digest)
+            logger.info("Successfully saved image fileType="+fileType+", fileName="+fileName)
+            self._count('saved')
+
+        except Exception:
+            logger.error("Failed to save image "+fileName+": "+traceback.format_exc())
+            self._count('failed')
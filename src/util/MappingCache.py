@@ -0,0 +1,57 @@
+'''
+Created on 18 Oct 2026
+'''
+from collections import OrderedDict
+
+
+# Bounded LRU cache of the data_source_mappings of one table, keyed by external id (int). Mappings are fetched on demand 
+# with lookupFunc(externalIds), which returns external_id -> (internal_id, mapping_id) for those that exist. External 
+# ids without a mapping are cached too (as None), so they are not looked up again
+class MappingCache:
+
+
+    # Constructor
+    def __init__(self, lookupFunc, maxSize):
+        self.lookupFunc = lookupFunc
+        self.maxSize = maxSize
+        self.mappings = OrderedDict()
+        self.lookups = 0
+        self.hits = 0
+
+
+    # Fetch the mappings of any of these external ids that are not already cached, in a single lookup
+    def prefetch(self, externalIds):
+        missing = {int(externalId) for externalId in externalIds} - self.mappings.keys()
+        if (len(missing) == 0):
+            return
+        
+        found = self.lookupFunc(missing)
+        for externalId in missing:
+            self._store(externalId, found.get(externalId))
+
+
+    # Returns (internal_id, mapping_id) for an external id, or None if it has no mapping
+    def get(self, externalId):
+        externalId = int(externalId)
+        self.lookups += 1
+        if (externalId in self.mappings):
+            self.hits += 1
+            self.mappings.move_to_end(externalId)
+            return self.mappings[externalId]
+        
+        mapping = self.lookupFunc([externalId]).get(externalId)
+        self._store(externalId, mapping)
+        return mapping
+
+
+    # Record a mapping that has just been created
+    def put(self, externalId, internal_id, mapping_id):
+        self._store(int(externalId), (internal_id, mapping_id))
+
+
+    # Add to the cache, evicting the least recently used mappings once it is full
+    def _store(self, externalId, mapping):
+        self.mappings[externalId] = mapping
+        self.mappings.move_to_end(externalId)
+        while (len(self.mappings) > self.maxSize):
+            self.mappings.popitem(last=False)
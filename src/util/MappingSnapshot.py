@@ -0,0 +1,108 @@
+'''
+Created on 18 Oct 2026
+
+Local SQLite copy of the team and player data_source_mappings of one data source, so imports do not have to wait on
+MySQL for them.
+
+The snapshot is refreshed incrementally by fetching only the mappings with a mapping_id greater than the last one seen.
+Mappings that are changed or deleted in MySQL are not picked up by a refresh, so the snapshot must be rebuilt after
+editing mappings by hand.
+'''
+import logging
+import os
+import sqlite3
+
+# Import local modules
+import config.Settings
+import util.IPUtils as IPUtils
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_VERSION = 1
+
+
+#
+# getSnapshotFileName: Returns the name of the snapshot file for a data source
+#
+def getSnapshotFileName(data_source):
+    return IPUtils.getUserPath(config.Settings.MAPPING_SNAPSHOT_FOLDER)+'/data_source_'+str(data_source)+'.sqlite'
+
+
+# Snapshot of the data_source_mappings of one data source, which backs the MappingCaches of an import
+class MappingSnapshot:
+
+
+    # Constructor. Opens (creating if needed) the snapshot file, starting again from empty if rebuild is True
+    def __init__(self, fileName, rebuild=False):
+        os.makedirs(os.path.dirname(fileName), exist_ok=True)
+        self.fileName = fileName
+        self.conn = sqlite3.connect(fileName)
+        self.conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+        self.conn.execute('''CREATE TABLE IF NOT EXISTS mapping (table_name TEXT NOT NULL, external_id INTEGER NOT NULL, 
+                             internal_id INTEGER NOT NULL, mapping_id INTEGER NOT NULL, PRIMARY KEY (table_name, external_id)) WITHOUT ROWID''')
+
+        if (rebuild or self._getMeta('version') != SNAPSHOT_VERSION):
+            with self.conn:
+                self.conn.execute("DELETE FROM mapping")
+                self.conn.execute("DELETE FROM meta")
+                self._setMeta('version', SNAPSHOT_VERSION)
+                self._setMeta('last_mapping_id', 0)
+
+
+    # Fetch the mappings added since the last refresh from MySQL (via a DataSourceMappingDao). Returns the number fetched
+    def refresh(self, mappingDao):
+        lastMappingId = self._getMeta('last_mapping_id')
+        numMappings = 0
+
+        # Written in a single transaction, so an interrupted refresh leaves the snapshot as it was
+        with self.conn:
+            for rows in mappingDao.getMappingsSince(lastMappingId, ('team', 'player'), config.Settings.MAPPING_LOOKUP_BATCH_SIZE):
+                # Rows come in mapping_id order, so the latest mapping for an external id is the one kept
+                self.conn.executemany("INSERT OR REPLACE INTO mapping (table_name, external_id, internal_id, mapping_id) VALUES (?, ?, ?, ?)", rows)
+                lastMappingId = rows[-1][3]
+                numMappings += len(rows)
+            self._setMeta('last_mapping_id', lastMappingId)
+
+        logger.info("Refreshed mapping snapshot "+self.fileName+" with "+str(numMappings)+" new mappings, last mapping_id="+str(lastMappingId))
+        return numMappings
+
+
+    # Add mappings [(table, external_id, internal_id, mapping_id)] that an import has just created, so they can still be
+    # found once evicted from its MappingCache. The last mapping_id seen is left alone, so the next refresh fetches them 
+    # again (replacing these rows) along with any mappings created elsewhere in the meantime
+    def addMappings(self, rows):
+        with self.conn:
+            self.conn.executemany("INSERT OR REPLACE INTO mapping (table_name, external_id, internal_id, mapping_id) VALUES (?, ?, ?, ?)", 
+                                  [(table, int(externalId), internal_id, mapping_id) for (table, externalId, internal_id, mapping_id) in rows])
+
+
+    # Get the mappings for a list of external ids of a table. Returns external_id -> (internal_id, mapping_id) for the 
+    # external ids that have a mapping
+    def getMappings(self, table, externalIds, batchSize):
+        mappings = {}
+        externalIds = [int(externalId) for externalId in externalIds]
+
+        for i in range(0, len(externalIds), batchSize):
+            batch = externalIds[i:i + batchSize]
+            getMappingsSql = ("SELECT external_id, internal_id, mapping_id FROM mapping WHERE table_name = ? AND external_id IN ("+
+                              ", ".join(["?"] * len(batch))+")")
+            for row in self.conn.execute(getMappingsSql, [table] + batch):
+                mappings[row[0]] = (row[1], row[2])
+
+        return mappings
+
+
+    # Close the snapshot file
+    def close(self):
+        self.conn.close()
+
+
+    # Get a value from the meta table, or None if it has not been set
+    def _getMeta(self, key):
+        row = self.conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return (row[0] if row != None else None)
+
+
+    # Set a value in the meta table
+    def _setMeta(self, key, value):
+        self.conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value))
@@ -0,0 +1,85 @@
+'''
+Created on 18 Oct 2026
+
+Parses the elements of a large XML file on a pool of processes, so that parsing (and e.g. decoding base64 images) is
+not limited to one core.
+
+The byte ranges of the elements (from XmlOffsetIndex) are split into shards of about IMPORT_SHARD_SIZE bytes, and each
+worker parses the elements of a shard and turns each one into a plain record (anything that can be pickled) with an 
+extract function. The records of each shard are given back to the calling process in file order, so that a single
+process does all DB writes.
+
+Workers are forked, so the extract function (and the pool initializer) can be a function of the calling script that
+reads its globals. They must not use the caller's DB connection.
+'''
+from collections import deque
+import multiprocessing
+
+from lxml import etree    # xml parsing
+
+# Import local modules
+import config.Settings
+
+
+#
+# getShards: Splits a list of element [start, end, keys] into shards of consecutive elements of about shardSize bytes.
+#            Returns a list of shards, each a list of (start, end)
+#
+def getShards(elements, shardSize):
+    shards = []
+    shard = []
+    shardBytes = 0
+
+    for element in elements:
+        shard.append((element[0], element[1]))
+        shardBytes += element[1] - element[0]
+        if (shardBytes >= shardSize):
+            shards.append(shard)
+            shard = []
+            shardBytes = 0
+
+    if (len(shard) > 0):
+        shards.append(shard)
+    return shards
+
+
+#
+# parseShard: Runs in a worker. Reads the elements of a shard with a single read of the file and returns the records that
+#             extractFunc gives for them (elements it gives None for are left out)
+#
+def parseShard(fileName, encoding, shard, extractFunc):
+    parser = etree.XMLParser(encoding=encoding)
+    shardStart = shard[0][0]
+    with open(fileName, 'rb') as xmlFile:
+        xmlFile.seek(shardStart)
+        shardBytes = xmlFile.read(shard[-1][1] - shardStart)
+
+    records = []
+    for (start, end) in shard:
+        record = extractFunc(etree.fromstring(shardBytes[start - shardStart:end - shardStart], parser))
+        if (record != None):
+            records.append(record)
+    return records
+
+
+#
+# parseShards: Generator parsing the given elements of an XML file on numWorkers processes, giving the list of records
+#              from each shard in file order. At most two shards per worker are in progress at once, which caps the memory
+#              used by records waiting to be processed
+#
+def parseShards(fileName, encoding, elements, extractFunc, numWorkers, initializer=None):
+    shards = iter(getShards(elements, config.Settings.IMPORT_SHARD_SIZE))
+    pending = deque()
+
+    with multiprocessing.get_context('fork').Pool(numWorkers, initializer) as pool:
+        for shard in shards:
+            pending.append(pool.apply_async(parseShard, (fileName, encoding, shard, extractFunc)))
+            if (len(pending) >= numWorkers * 2):
+                break
+
+        while (len(pending) > 0):
+            records = pending.popleft().get()
+            shard = next(shards, None)
+            if (shard != None):
+                pending.append(pool.apply_async(parseShard, (fileName, encoding, shard, extractFunc)))
+            yield records
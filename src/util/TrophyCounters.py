@@ -0,0 +1,173 @@
+'''
+Created on 18 Oct 2026
+
+Local SQLite store of per-user totals used by history based trophies (the number of times each user has banked, and
+the number of users they have invited), so they do not have to be re-counted from each user's whole history.
+
+The totals are brought up to date incrementally from high-water marks on game_entry_id and user_invite_id. The
+game_entry high-water mark only advances through entries of games that have finished, as selections in games still in
+play can change, so a user's live total is their stored total plus what is above the high-water mark.
+
+An invite can get a user_invite_id below the high-water mark but only be committed after a refresh has read past it, so
+each refresh also re-reads the last TROPHY_COUNTER_INVITE_RESCAN ids below the mark. The ids counted in that window are
+recorded, so late invites are counted without any invite being counted twice.
+'''
+import logging
+import os
+import sqlite3
+import threading
+
+# Import local modules
+import config.Settings
+import metadata.State
+
+logger = logging.getLogger(__name__)
+
+COUNTERS_VERSION = 2
+COUNTERS = ('banks', 'invites')
+UNFINISHED_STATES = (metadata.State.INACTIVE, metadata.State.PREPLAY, metadata.State.TRANSITION, metadata.State.INPLAY, metadata.State.SUSPENDED)
+
+
+# Per-user counters. Counts can be read from several threads at once
+class TrophyCounters:
+
+
+    # Constructor. Opens (creating if needed) the counters file, starting again from empty if rebuild is True
+    def __init__(self, fileName, rebuild=False):
+        os.makedirs(os.path.dirname(fileName), exist_ok=True)
+        self.fileName = fileName
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(fileName, check_same_thread=False)
+        self.conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS counter (user INTEGER PRIMARY KEY, banks INTEGER NOT NULL DEFAULT 0, invites INTEGER NOT NULL DEFAULT 0)")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS counted_invite (user_invite_id INTEGER PRIMARY KEY)")
+
+        if (rebuild or self._getMeta('version') != COUNTERS_VERSION):
+            with self.conn:
+                self.conn.execute("DELETE FROM counter")
+                self.conn.execute("DELETE FROM counted_invite")
+                self.conn.execute("DELETE FROM meta")
+                self._setMeta('version', COUNTERS_VERSION)
+                self._setMeta('game_entry_id', 0)
+                self._setMeta('user_invite_id', 0)
+
+
+    # Add the banks of game entries and the invites made since the high-water marks, reading them from MySQL (db)
+    def refresh(self, db):
+        while True:
+            lastGameEntryId = self._getMeta('game_entry_id')
+            lastUserInviteId = self._getMeta('user_invite_id')
+            (newGameEntryId, banks, newUserInviteId, inviteRows) = self._readIncrements(db, lastGameEntryId, lastUserInviteId)
+
+            # Written in a single exclusive transaction, so an interrupted refresh leaves the counters as they were. Another
+            # run may have refreshed the counters while we were reading from MySQL, in which case the increments are read
+            # again from its high-water marks, so they are never added twice
+            with self.lock:
+                self.conn.execute("BEGIN IMMEDIATE")
+                try:
+                    if (self._getMeta('game_entry_id') != lastGameEntryId or self._getMeta('user_invite_id') != lastUserInviteId):
+                        self.conn.rollback()
+                        logger.info("Trophy counters "+self.fileName+" were refreshed by another run, reading increments again")
+                        continue
+
+                    invites = self._getNewInvites(inviteRows, newUserInviteId)
+                    for (counter, increments) in (('banks', banks), ('invites', invites)):
+                        self.conn.executemany("INSERT OR IGNORE INTO counter (user) VALUES (?)", [(user_id,) for (count, user_id) in increments])
+                        self.conn.executemany("UPDATE counter SET "+counter+" = "+counter+" + ? WHERE user = ?", increments)
+                    self._setMeta('game_entry_id', newGameEntryId)
+                    self._setMeta('user_invite_id', newUserInviteId)
+                    self.conn.commit()
+                except Exception:
+                    self.conn.rollback()
+                    raise
+            break
+
+        logger.info("Refreshed trophy counters "+self.fileName+": banks for "+str(len(banks))+" users up to game_entry_id="+str(newGameEntryId)+
+                    ", invites for "+str(len(invites))+" users up to user_invite_id="+str(newUserInviteId))
+
+
+    # Read the increments since the given high-water marks from MySQL (db). Returns a tuple of (new game_entry_id 
+    # high-water mark, [(banks, user_id)], new user_invite_id high-water mark, [(user_invite_id, source_user)] of the 
+    # invites since the user_invite high-water mark and in the window re-read below it)
+    def _readIncrements(self, db, lastGameEntryId, lastUserInviteId):
+        cursor = db.cursor()
+
+        # Entries up to just below the first entry of a game that has not finished are final
+        cursor.execute('''SELECT MIN(ge.game_entry_id) FROM game_entry ge JOIN game g ON ge.game = g.game_id 
+                          WHERE ge.game_entry_id > %s AND g.state IN ('''+", ".join(["%s"] * len(UNFINISHED_STATES))+")", 
+                       [lastGameEntryId] + list(UNFINISHED_STATES))
+        (firstUnfinishedGameEntryId,) = cursor.fetchone()
+        if (firstUnfinishedGameEntryId != None):
+            newGameEntryId = firstUnfinishedGameEntryId - 1
+        else:
+            cursor.execute("SELECT MAX(game_entry_id) FROM game_entry")
+            newGameEntryId = (cursor.fetchone()[0] or lastGameEntryId)
+
+        cursor.execute('''SELECT ge.user, SUM(ps.cashed_out) FROM game_entry ge JOIN period_selection ps ON ge.game_entry_id = ps.game_entry
+                          WHERE ge.game_entry_id > %s AND ge.game_entry_id <= %s GROUP BY ge.user''', (lastGameEntryId, newGameEntryId))
+        banks = [(int(row[1] or 0), row[0]) for row in cursor.fetchall()]
+
+        cursor.execute("SELECT MAX(user_invite_id) FROM user_invite")
+        newUserInviteId = (cursor.fetchone()[0] or lastUserInviteId)
+        cursor.execute("SELECT user_invite_id, source_user FROM user_invite WHERE user_invite_id > %s AND user_invite_id <= %s", 
+                       (lastUserInviteId - config.Settings.TROPHY_COUNTER_INVITE_RESCAN, newUserInviteId))
+        inviteRows = cursor.fetchall()
+        cursor.close()
+
+        return (newGameEntryId, banks, newUserInviteId, inviteRows)
+
+
+    # Returns [(invites, user_id)] of the invites in inviteRows that have not already been counted, and records the ids of
+    # those that will be re-read by the next refresh (the window below the new high-water mark). Must be called inside 
+    # the refresh transaction
+    def _getNewInvites(self, inviteRows, newUserInviteId):
+        windowStart = newUserInviteId - config.Settings.TROPHY_COUNTER_INVITE_RESCAN
+        counted = {row[0] for row in self.conn.execute("SELECT user_invite_id FROM counted_invite")}
+        newInviteRows = [(user_invite_id, user_id) for (user_invite_id, user_id) in inviteRows if user_invite_id not in counted]
+
+        self.conn.executemany("INSERT INTO counted_invite (user_invite_id) VALUES (?)", 
+                              [(user_invite_id,) for (user_invite_id, user_id) in newInviteRows if user_invite_id > windowStart])
+        self.conn.execute("DELETE FROM counted_invite WHERE user_invite_id <= ?", (windowStart,))
+
+        invites = {}
+        for (user_invite_id, user_id) in newInviteRows:
+            invites[user_id] = invites.get(user_id, 0) + 1
+        return [(count, user_id) for user_id, count in invites.items()]
+
+
+    # Returns the high-water mark (game_entry_id or user_invite_id) that the counters are up to date with
+    def getHighWaterMark(self, key):
+        with self.lock:
+            return self._getMeta(key)
+
+
+    # Returns user_id -> stored count ('banks' or 'invites') for the given users that have a count
+    def getCounts(self, counter, user_ids):
+        if (counter not in COUNTERS):
+            raise ValueError("Unknown counter "+counter)
+
+        user_ids = list(user_ids)
+        counts = {}
+        with self.lock:
+            # SQLite limits the number of parameters in a statement, so look up in batches
+            for i in range(0, len(user_ids), 500):
+                batch = user_ids[i:i + 500]
+                for row in self.conn.execute("SELECT user, "+counter+" FROM counter WHERE user IN ("+", ".join(["?"] * len(batch))+")", batch):
+                    counts[row[0]] = row[1]
+        return counts
+
+
+    # Close the counters file
+    def close(self):
+        self.conn.close()
+
+
+    # Get a value from the meta table, or None if it has not been set
+    def _getMeta(self, key):
+        row = self.conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return (row[0] if row != None else None)
+
+
+    # Set a value in the meta table
+    def _setMeta(self, key, value):
+        self.conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value))
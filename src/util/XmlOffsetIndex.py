@@ -0,0 +1,123 @@
+'''
+Created on 18 Oct 2026
+
+Byte offset index of the elements in a large XML file (e.g. the <team> elements of goalserve's teams.xml), so that only
+the elements that are needed have to be read and parsed.
+
+The index is built with a single scan of the raw bytes (no XML parsing) and saved in a sidecar file (<fileName>.idx.json)
+recording the byte range of each element and the keys (e.g. league ids) found in it. It is rebuilt automatically if the
+XML file changes.
+'''
+import json
+import mmap
+import os
+import re
+
+from lxml import etree    # xml parsing
+
+INDEX_VERSION = 1
+XML_ENCODING = re.compile(rb'''<\?xml[^>]*encoding=["']([A-Za-z0-9._-]+)["']''')
+
+
+#
+# getIndexFileName: Returns the name of the index file written alongside an XML file
+#
+def getIndexFileName(fileName):
+    return fileName+'.idx.json'
+
+
+#
+# scanElements: Scans an XML file for each <tag> element, without parsing it. Returns a tuple of (encoding, elements) where
+#               elements is a list of [start, end, keys] giving the byte range of each element and the keys matched by 
+#               keyPattern (a bytes regex with one group) inside it (or only in its start tag if startTagOnly, which 
+#               saves searching the whole element). Elements must not contain nested <tag> elements
+#
+def scanElements(fileName, tag, keyPattern=None, startTagOnly=False):
+    elementStart = re.compile(b'<'+tag.encode('ascii')+rb'[\s>/]')
+    elementEnd = b'</'+tag.encode('ascii')+b'>'
+    keyRegex = (re.compile(keyPattern) if keyPattern != None else None)
+    elements = []
+
+    with open(fileName, 'rb') as xmlFile, mmap.mmap(xmlFile.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+        encodingMatch = XML_ENCODING.match(buffer[:200])
+        position = 0
+
+        while True:
+            match = elementStart.search(buffer, position)
+            if (match == None):
+                break
+
+            start = match.start()
+            tagEnd = buffer.find(b'>', start)
+            if (buffer[tagEnd - 1:tagEnd] == b'/'):
+                end = tagEnd + 1
+            else:
+                end = buffer.find(elementEnd, tagEnd)
+                if (end == -1):
+                    raise ValueError("Unclosed <"+tag+"> element at byte "+str(start)+" of "+fileName)
+                end += len(elementEnd)
+
+            keyEnd = (tagEnd + 1 if startTagOnly else end)
+            keys = (sorted({key.decode('utf-8') for key in keyRegex.findall(buffer, start, keyEnd)}) if keyRegex != None else [])
+            elements.append([start, end, keys])
+            position = end
+
+    return ((encodingMatch.group(1).decode('ascii') if encodingMatch else 'utf-8'), elements)
+
+
+#
+# buildIndex: Scans an XML file for each <tag> element, recording its byte range and the keys matched by keyPattern
+#             (a bytes regex with one group) inside it, and saves the index
+#
+def buildIndex(fileName, tag, keyPattern):
+    (encoding, elements) = scanElements(fileName, tag, keyPattern)
+    fileStat = os.stat(fileName)
+    index = {'version' : INDEX_VERSION,
+             'size' : fileStat.st_size,
+             'mtime_ns' : fileStat.st_mtime_ns,
+             'tag' : tag,
+             'encoding' : encoding,
+             'elements' : elements}
+
+    tempFile = getIndexFileName(fileName)+'.tmp'
+    with open(tempFile, 'w') as indexFile:
+        json.dump(index, indexFile)
+    os.rename(tempFile, getIndexFileName(fileName))
+    return index
+
+
+#
+# loadIndex: Returns the saved index for an XML file, building it first if there is none or the XML file has changed
+#            since it was built. Returns a tuple of (index, True if the index was (re)built)
+#
+def loadIndex(fileName, tag, keyPattern):
+    indexFileName = getIndexFileName(fileName)
+    if (os.path.exists(indexFileName)):
+        with open(indexFileName) as indexFile:
+            index = json.load(indexFile)
+        fileStat = os.stat(fileName)
+        if (index.get('version') == INDEX_VERSION and index['tag'] == tag and index['size'] == fileStat.st_size and
+            index['mtime_ns'] == fileStat.st_mtime_ns):
+            return (index, False)
+
+    return (buildIndex(fileName, tag, keyPattern), True)
+
+
+#
+# getElements: Returns the [start, end, keys] of the indexed elements that have any of the given keys
+#
+def getElements(index, keys):
+    return [element for element in index['elements'] if not keys.isdisjoint(element[2])]
+
+
+#
+# iterElements: Generator parsing and giving only the indexed elements that have any of the given keys, by seeking
+#               straight to each one's byte range
+#
+def iterElements(fileName, index, keys):
+    parser = etree.XMLParser(encoding=index['encoding'])
+
+    with open(fileName, 'rb') as xmlFile:
+        for (start, end, elementKeys) in getElements(index, keys):
+            xmlFile.seek(start)
+            yield etree.fromstring(xmlFile.read(end - start), parser)